@@ -0,0 +1,82 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from fixture_server import start_fixture_server, RPC_PATH, BLOCKSCOUT_PATH
+
+# record once against the live endpoints, then replay without network:
+#   LISK_RPC=<url> python benchmarks/epoch.py benchmarks/lisk_epoch.json \
+#       ./cache/fixtures.sqlite --record
+#   python benchmarks/epoch.py benchmarks/lisk_epoch.json \
+#       ./cache/fixtures.sqlite --latency-ms 50
+
+
+def run(config_file: str, fixtures: str, latency: float, record: bool) -> None:
+    server = start_fixture_server(
+        fixtures,
+        latency,
+        os.getenv("LISK_RPC") if record else None,
+        (
+            os.getenv("BLOCKSCOUT_API_URL", "https://blockscout.lisk.com/api/v2")
+            if record
+            else None
+        ),
+    )
+    # every run starts cold, so the traffic is the one of a first run
+    directory = tempfile.mkdtemp()
+    os.environ["LISK_RPC"] = server.get_url(RPC_PATH)
+    os.environ["BLOCKSCOUT_API_URL"] = server.get_url(BLOCKSCOUT_PATH)
+    os.environ["RPC_CACHE_PATH"] = os.path.join(directory, "rpc.sqlite")
+    os.environ["EVENT_CACHE_PATH"] = os.path.join(directory, "events.sqlite")
+    os.environ["POSITION_STORE_PATH"] = os.path.join(directory, "positions.sqlite")
+    os.environ["CHECKPOINT_PATH"] = os.path.join(directory, "checkpoints")
+
+    # settings are read when the modules are imported
+    from collect_rewards import calculate_rewards_batch
+    from utils.profiling import profiler
+
+    with open(config_file, "r") as f:
+        vault_configs = json.load(f)
+    for vault_config in vault_configs:
+        vault_config["label"] = os.path.join(directory, "distributions")
+
+    start = time.perf_counter()
+    calculate_rewards_batch(vault_configs)
+    elapsed = time.perf_counter() - start
+
+    print(
+        "epoch: {:.2f}s, {} requests, {} without fixture, latency {:.0f}ms".format(
+            elapsed, server.requests, server.misses, latency * 1000
+        )
+    )
+    report = profiler.get_report()
+    for name, stage in sorted(
+        report["stages"].items(), key=lambda item: -item[1]["seconds"]
+    ):
+        print(
+            "  {}: {:.2f}s in {} calls".format(name, stage["seconds"], stage["calls"])
+        )
+    for name, value in sorted(report["counters"].get("rpc", {}).items()):
+        print("  {}: {}".format(name, value))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time calculate_rewards_batch against recorded fixtures"
+    )
+    parser.add_argument("config", help="json list of calculate_rewards arguments")
+    parser.add_argument("fixtures", help="sqlite file with the recorded responses")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument(
+        "--record",
+        action="store_true",
+        help="record the responses missing from the fixtures from LISK_RPC "
+        "and BLOCKSCOUT_API_URL",
+    )
+    args = parser.parse_args()
+    run(args.config, args.fixtures, args.latency_ms / 1000, args.record)
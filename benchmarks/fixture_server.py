@@ -0,0 +1,254 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Any, Dict, Optional, Tuple
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+import requests
+
+# the scripts are pointed at the server with
+#   LISK_RPC=http://127.0.0.1:<port>/rpc
+#   BLOCKSCOUT_API_URL=http://127.0.0.1:<port>/api/v2
+RPC_PATH = "/rpc"
+BLOCKSCOUT_PATH = "/api/v2"
+UPSTREAM_TIMEOUT = 60
+
+
+def get_rpc_key(request: Dict[str, Any]) -> str:
+    # ids differ between runs, method and params do not
+    return "rpc:" + json.dumps([request["method"], request["params"]], sort_keys=True)
+
+
+def get_blockscout_key(path: str, query: str) -> str:
+    return (
+        "blockscout:"
+        + path
+        + "?"
+        + urlencode(sorted(parse_qsl(query, keep_blank_values=True)))
+    )
+
+
+class FixtureStore:
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS fixtures ("
+            "key TEXT PRIMARY KEY, "
+            "status INTEGER NOT NULL, "
+            "response TEXT NOT NULL)"
+        )
+        self.connection.commit()
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM fixtures").fetchone()[
+                0
+            ]
+
+    def get(self, key: str) -> Optional[Tuple[int, Any]]:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT status, response FROM fixtures WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def put(self, key: str, status: int, response: Any) -> None:
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO fixtures (key, status, response) VALUES (?, ?, ?)",
+                (key, status, json.dumps(response)),
+            )
+            self.connection.commit()
+
+
+class FixtureServer(ThreadingHTTPServer):
+    # replays recorded JSON-RPC and Blockscout responses; when recording,
+    # the requests missing from the fixtures are forwarded upstream and
+    # their responses stored
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        store: FixtureStore,
+        latency: float = 0.0,
+        rpc_url: Optional[str] = None,
+        blockscout_url: Optional[str] = None,
+    ):
+        super().__init__(address, FixtureHandler)
+        self.store = store
+        self.latency = latency
+        self.rpc_url = rpc_url
+        self.blockscout_url = blockscout_url
+        self.session = requests.Session()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.misses = 0
+
+    def get_url(self, path: str) -> str:
+        return "http://{}:{}{}".format(
+            self.server_address[0], self.server_address[1], path
+        )
+
+    def count(self, requests_count: int, misses: int) -> None:
+        with self.lock:
+            self.requests += requests_count
+            self.misses += misses
+
+    def call_rpc(self, rpc_requests: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        responses: List[Optional[Dict[str, Any]]] = []
+        missing = []
+        for index, request in enumerate(rpc_requests):
+            fixture = self.store.get(get_rpc_key(request))
+            if fixture is None:
+                missing.append(index)
+                responses.append(None)
+            else:
+                responses.append({**fixture[1], "id": request["id"]})
+        self.count(len(rpc_requests), len(missing))
+        if missing and self.rpc_url is not None:
+            items = self.session.post(
+                self.rpc_url,
+                json=[rpc_requests[index] for index in missing],
+                timeout=UPSTREAM_TIMEOUT,
+            ).json()
+            if not isinstance(items, list):
+                items = [items]
+            items = {item.get("id"): item for item in items}
+            for index in missing:
+                item = items.get(rpc_requests[index]["id"])
+                if item is None:
+                    continue
+                if "result" in item:
+                    fixture = {"jsonrpc": "2.0", "result": item["result"]}
+                else:
+                    fixture = {"jsonrpc": "2.0", "error": item["error"]}
+                self.store.put(get_rpc_key(rpc_requests[index]), 200, fixture)
+                responses[index] = {**fixture, "id": rpc_requests[index]["id"]}
+        for index, request in enumerate(rpc_requests):
+            if responses[index] is None:
+                responses[index] = {
+                    "jsonrpc": "2.0",
+                    "id": request["id"],
+                    "error": {"code": -32000, "message": "no fixture recorded"},
+                }
+        return responses
+
+    def call_blockscout(self, path: str, query: str) -> Tuple[int, Any]:
+        key = get_blockscout_key(path, query)
+        fixture = self.store.get(key)
+        self.count(1, 1 if fixture is None else 0)
+        if fixture is not None:
+            return fixture
+        if self.blockscout_url is None:
+            return 404, {"message": "no fixture recorded"}
+        response = self.session.get(
+            self.blockscout_url + path,
+            params=parse_qsl(query, keep_blank_values=True),
+            headers={"accept": "application/json"},
+            timeout=UPSTREAM_TIMEOUT,
+        )
+        fixture = (response.status_code, response.json())
+        # failed requests are retried by the client, so they are not kept
+        if response.status_code == 200:
+            self.store.put(key, *fixture)
+        return fixture
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    server: FixtureServer
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def send_json(self, status: int, data: Any) -> None:
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self) -> None:
+        time.sleep(self.server.latency)
+        if urlsplit(self.path).path != RPC_PATH:
+            self.send_json(404, {"message": "unknown path"})
+            return
+        data = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if isinstance(data, list):
+            self.send_json(200, self.server.call_rpc(data))
+        else:
+            self.send_json(200, self.server.call_rpc([data])[0])
+
+    def do_GET(self) -> None:
+        time.sleep(self.server.latency)
+        url = urlsplit(self.path)
+        if not url.path.startswith(BLOCKSCOUT_PATH):
+            self.send_json(404, {"message": "unknown path"})
+            return
+        self.send_json(
+            *self.server.call_blockscout(url.path[len(BLOCKSCOUT_PATH) :], url.query)
+        )
+
+
+def start_fixture_server(
+    fixtures: str,
+    latency: float = 0.0,
+    rpc_url: Optional[str] = None,
+    blockscout_url: Optional[str] = None,
+    port: int = 0,
+) -> FixtureServer:
+    server = FixtureServer(
+        ("127.0.0.1", port), FixtureStore(fixtures), latency, rpc_url, blockscout_url
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Record or replay the RPC and Blockscout traffic of a run"
+    )
+    parser.add_argument("fixtures", help="sqlite file with the recorded responses")
+    parser.add_argument("--port", type=int, default=8545)
+    parser.add_argument(
+        "--latency-ms", type=float, default=0.0, help="delay added to every request"
+    )
+    parser.add_argument(
+        "--record",
+        action="store_true",
+        help="forward requests without a fixture to LISK_RPC and BLOCKSCOUT_API_URL",
+    )
+    args = parser.parse_args()
+
+    server = start_fixture_server(
+        args.fixtures,
+        args.latency_ms / 1000,
+        os.getenv("LISK_RPC") if args.record else None,
+        (
+            os.getenv("BLOCKSCOUT_API_URL", "https://blockscout.lisk.com/api/v2")
+            if args.record
+            else None
+        ),
+        args.port,
+    )
+    print("LISK_RPC={}".format(server.get_url(RPC_PATH)))
+    print("BLOCKSCOUT_API_URL={}".format(server.get_url(BLOCKSCOUT_PATH)))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        print(
+            "{} requests, {} without fixture, {} fixtures".format(
+                server.requests, server.misses, len(server.store)
+            )
+        )
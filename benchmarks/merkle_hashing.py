@@ -0,0 +1,72 @@
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from web3 import Web3
+from eth_abi import encode
+from utils.merkle_proof import build_merkle_tree
+
+REWARD_TOKEN = "0xac485391EB2d7D88253a7F1eF18C37f4242D1A24"
+
+
+def reference_root(users, balances, reward_token) -> bytes:
+    # per-item web3 hashing, as generate_merkle_tree used to do it
+    n = len(users)
+    leaves = [
+        Web3.keccak(
+            Web3.keccak(
+                encode(
+                    ["address", "address", "uint256"],
+                    [users[i], reward_token, balances[i]],
+                )
+            )
+        )
+        for i in range(n)
+    ]
+    sorted_leaves = sorted(leaves)
+    tree = [None for _ in range(2 * n - 1)]
+    for i in range(n):
+        tree[len(tree) - 1 - i] = sorted_leaves[i]
+    for i in range(n, 2 * n - 1):
+        v = len(tree) - 1 - i
+        left_hash = tree[v * 2 + 1]
+        right_hash = tree[v * 2 + 2]
+        if left_hash > right_hash:
+            left_hash, right_hash = right_hash, left_hash
+        tree[v] = Web3.keccak(encode(["bytes32", "bytes32"], [left_hash, right_hash]))
+    return bytes(tree[0])
+
+
+def generate_claimants(n: int):
+    rng = random.Random(n)
+    users = [Web3.to_checksum_address("0x" + rng.randbytes(20).hex()) for _ in range(n)]
+    balances = [rng.randint(1, 10**24) for _ in range(n)]
+    return users, balances
+
+
+def run(sizes):
+    for n in sizes:
+        users, balances = generate_claimants(n)
+
+        start = time.perf_counter()
+        expected = reference_root(users, balances, REWARD_TOKEN)
+        reference_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        root = build_merkle_tree(users, balances, REWARD_TOKEN).root
+        batched_time = time.perf_counter() - start
+
+        if root != expected:
+            raise Exception("root mismatch for n={}".format(n))
+        print(
+            "n={}: web3 {:.3f}s, batched {:.3f}s, speedup x{:.2f}".format(
+                n, reference_time, batched_time, reference_time / batched_time
+            )
+        )
+
+
+if __name__ == "__main__":
+    run([int(x) for x in sys.argv[1:]] or [1000, 10000, 100000])
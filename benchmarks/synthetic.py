@@ -0,0 +1,353 @@
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from eth_abi import encode
+from web3 import Web3
+from utils.common import DeFiService, ZERO_ADDRESS
+from utils.engine import accumulate_balances
+from utils.verification import Verifier
+from utils.merkle_proof import generate_merkle_tree
+from services.velodrome_v2_service import VelodromeV2Service
+from services.velodrome_v3_service import VelodromeV3Service
+from services.morpho_service import MorphoService
+
+# sizes at scale 1, every scale multiplies holders and positions
+HOLDERS = 1000
+POSITIONS = 200
+TRANSFER_BLOCKS = 300
+SNAPSHOT_BLOCKS = 100
+TO_BLOCK = 100000
+REWARD_TOKEN = "0xac485391EB2d7D88253a7F1eF18C37f4242D1A24"
+POOL = "0x00000000000000000000000000000000000000f1"
+GAUGE = "0x00000000000000000000000000000000000000f2"
+
+
+def get_addresses(count: int, rng: random.Random):
+    return [
+        Web3.to_checksum_address("0x" + rng.randbytes(20).hex()) for _ in range(count)
+    ]
+
+
+class SyntheticService(DeFiService):
+    # replays generated distributions at its change blocks
+    def __init__(self, pool: str, snapshots):
+        self.pool = pool
+        self.snapshots = snapshots
+        self.block_numbers = sorted(snapshots.keys())
+        self.iterator = 0
+        self.cached_block_number = None
+        self.cached_distributions = []
+
+    def name(self) -> str:
+        return "SyntheticService"
+
+    def fetch_snapshot(
+        self, block_number, consumed_block_numbers, previous_block_number
+    ):
+        return self.snapshots[consumed_block_numbers[-1]]
+
+    def apply_snapshot(self, block_number, consumed_block_numbers, snapshot):
+        self.cached_block_number = block_number
+        self.cached_distributions = snapshot
+        return self.pool, self.cached_distributions
+
+    def calculate_distributions(self, block_number):
+        consumed_block_numbers = self.consume_block_numbers(block_number)
+        if not consumed_block_numbers:
+            return self.pool, self.cached_distributions
+        snapshot = self.timed_fetch_snapshot(
+            block_number, consumed_block_numbers, self.cached_block_number
+        )
+        return self.timed_apply_snapshot(block_number, consumed_block_numbers, snapshot)
+
+
+def run_accumulation(scale: int) -> float:
+    rng = random.Random(scale)
+    holders = get_addresses(HOLDERS * scale, rng)
+    transfers = [
+        {
+            "from": ZERO_ADDRESS,
+            "to": holder,
+            "amount": rng.randint(1, 10**21),
+            "block_number": 0,
+        }
+        for holder in holders + [POOL]
+    ]
+    for block_number in sorted(rng.sample(range(1, TO_BLOCK), TRANSFER_BLOCKS)):
+        sender, receiver = rng.sample(holders, 2)
+        transfers.append(
+            {"from": sender, "to": receiver, "amount": 1, "block_number": block_number}
+        )
+    pool_users = holders[: POSITIONS * scale]
+    snapshots = {
+        block_number: [(user, rng.randint(1, 10**18)) for user in pool_users]
+        for block_number in rng.sample(range(TO_BLOCK), SNAPSHOT_BLOCKS)
+    }
+
+    start = time.perf_counter()
+    accumulate_balances(
+        "0xVault",
+        transfers,
+        [SyntheticService(POOL, snapshots)],
+        0,
+        TO_BLOCK,
+        lookahead=0,
+        verifier=Verifier("off"),
+    )
+    return time.perf_counter() - start
+
+
+def run_v3_snapshot(scale: int) -> float:
+    rng = random.Random(scale)
+    positions = POSITIONS * scale
+    owners = get_addresses(HOLDERS * scale, rng)
+    stakers = owners[:10]
+    token_ids = list(range(1, positions + 1))
+    staked_token_ids = {staker: [] for staker in stakers}
+    responses = []
+    for token_id in token_ids:
+        owner = rng.choice(owners)
+        if rng.random() < 0.2:
+            staked_token_ids[rng.choice(stakers)].append(token_id)
+            owner = GAUGE
+        responses.append((True, encode(["address"], [owner])))
+    for _ in token_ids:
+        responses.append(
+            (True, encode(["uint256", "uint256"], [rng.randint(0, 10**18), 0]))
+        )
+        responses.append(
+            (True, encode(["uint256", "uint256"], [rng.randint(0, 10**20), 0]))
+        )
+    for staker in stakers:
+        responses.append((True, encode(["uint256[]"], [staked_token_ids[staker]])))
+
+    # built without __init__, which reads the pool from the chain
+    service = VelodromeV3Service.__new__(VelodromeV3Service)
+    service.pool = POOL
+    service.gauge = Web3.to_checksum_address(GAUGE)
+    service.token_index = 0
+    service.token_ids = token_ids
+    service.owners = {}
+    service.amounts = {}
+    service.staked_owners = {}
+    service.cached_distributions = []
+    service.cached_block_number = None
+
+    start = time.perf_counter()
+    service.apply_snapshot(
+        1,
+        [1],
+        {
+            "owner_token_ids": token_ids,
+            "amount_token_ids": token_ids,
+            "burned_token_ids": [],
+            "stakers": stakers,
+            "responses": responses,
+        },
+    )
+    return time.perf_counter() - start
+
+
+class SyntheticV3Chain:
+    # answers the slot0, position manager, sugar helper and gauge calls of
+    # a velodrome v3 service from generated per-block state
+    def __init__(self, owners, amounts, staked_token_ids):
+        # block -> token id -> owner / amount, block -> staker -> token ids
+        self.owners = owners
+        self.amounts = amounts
+        self.staked_token_ids = staked_token_ids
+        self.functions = self
+
+    def slot0(self):
+        return self
+
+    def call(self, block_identifier):
+        # the price never moves, so only touched positions are refreshed
+        return [2**96]
+
+    def try_aggregate(self, calls, block_number):
+        responses = []
+        for _, call_data in calls:
+            selector = call_data[:10]
+            arguments = call_data[10:]
+            if selector == "0x6352211e":
+                owner = self.owners[block_number][int(arguments[:64], 16)]
+                responses.append((True, encode(["address"], [owner])))
+            elif selector in ["0x263a5362", "0x22635397"]:
+                amount = self.amounts[block_number][int(arguments[64:128], 16)]
+                responses.append((True, encode(["uint256", "uint256"], [amount, 0])))
+            else:
+                staker = Web3.to_checksum_address("0x" + arguments[24:64])
+                token_ids = self.staked_token_ids[block_number].get(staker, [])
+                responses.append((True, encode(["uint256[]"], [token_ids])))
+        return responses
+
+
+def create_synthetic_v3_service(
+    chain, token_ids, ticks, stakers, nft_transfers, pool_event_ticks
+):
+    # built without __init__, which reads the pool from the chain
+    service = VelodromeV3Service.__new__(VelodromeV3Service)
+    service.pool = POOL
+    service.gauge = Web3.to_checksum_address(GAUGE)
+    service.token_index = 0
+    service.token_ids = token_ids
+    service.token_ranges = {token_id: (0, None) for token_id in token_ids}
+    service.ticks = ticks
+    service.users = {staker: 0 for staker in stakers}
+    service.nft_transfers = nft_transfers
+    service.pool_event_ticks = pool_event_ticks
+    service.block_numbers = sorted(set(nft_transfers) | set(pool_event_ticks))
+    service.pool_contract = chain
+    service.multicall = chain
+    service.iterator = 0
+    service.owners = {}
+    service.amounts = {}
+    service.staked_owners = {}
+    service.cached_distributions = []
+    service.cached_block_number = None
+    return service
+
+
+def run_v3_delta_snapshot(scale: int) -> float:
+    # block 2 only has mints, burns, collects and nft transfers without a
+    # price move, so the service refreshes the touched positions only; the
+    # result has to match a full snapshot of the same block
+    rng = random.Random(scale)
+    positions = POSITIONS * scale
+    holders = get_addresses(HOLDERS * scale, rng)
+    stakers = holders[:10]
+    gauge = Web3.to_checksum_address(GAUGE)
+    token_ids = list(range(1, positions + 1))
+    ticks = {
+        token_id: (-60 * rng.randint(1, 50), 60 * rng.randint(1, 50))
+        for token_id in token_ids
+    }
+    owners = {1: {}}
+    amounts = {1: {}}
+    staked_token_ids = {1: {staker: [] for staker in stakers}}
+    for token_id in token_ids:
+        amounts[1][token_id] = rng.randint(1, 10**20)
+        if rng.random() < 0.2:
+            owners[1][token_id] = gauge
+            staked_token_ids[1][rng.choice(stakers)].append(token_id)
+        else:
+            owners[1][token_id] = rng.choice(holders)
+
+    touched_ticks = set(rng.sample(sorted(set(ticks.values())), 10))
+    owners[2] = dict(owners[1])
+    amounts[2] = {
+        token_id: amount + (10**18 if ticks[token_id] in touched_ticks else 0)
+        for token_id, amount in amounts[1].items()
+    }
+    staked_token_ids[2] = {
+        staker: list(token_ids) for staker, token_ids in staked_token_ids[1].items()
+    }
+    transfers = []
+    unstaked_token_ids = [
+        token_id for token_id in token_ids if owners[1][token_id] != gauge
+    ]
+    for token_id in rng.sample(unstaked_token_ids, 20):
+        sender = owners[1][token_id]
+        if token_id % 2 == 0:
+            # deposited into the gauge by a staker
+            sender = rng.choice(stakers)
+            owners[1][token_id] = sender
+            owners[2][token_id] = gauge
+            staked_token_ids[2][sender].append(token_id)
+            transfers.append((token_id, sender, gauge))
+        else:
+            owners[2][token_id] = rng.choice(holders)
+            transfers.append((token_id, sender, owners[2][token_id]))
+
+    chain = SyntheticV3Chain(owners, amounts, staked_token_ids)
+    nft_transfers = {2: transfers}
+    pool_event_ticks = {1: None, 2: touched_ticks}
+    expected = create_synthetic_v3_service(
+        chain, token_ids, ticks, stakers, nft_transfers, pool_event_ticks
+    )
+    expected.apply_snapshot(2, [2], expected.fetch_snapshot(2, [2], None))
+
+    service = create_synthetic_v3_service(
+        chain, token_ids, ticks, stakers, nft_transfers, pool_event_ticks
+    )
+    service.calculate_distributions(1)
+    start = time.perf_counter()
+    service.calculate_distributions(2)
+    elapsed = time.perf_counter() - start
+
+    if service.cached_distributions != expected.cached_distributions:
+        raise Exception("v3 delta snapshot mismatch for scale={}".format(scale))
+    return elapsed
+
+
+def run_v2_snapshot(scale: int) -> float:
+    rng = random.Random(scale)
+    users = get_addresses(POSITIONS * scale, rng)
+    balances = [rng.randint(0, 10**18) for _ in users]
+    service = VelodromeV2Service(None, "0xVault", POOL, users, [1])
+    service.verifier = Verifier("off")
+
+    start = time.perf_counter()
+    service.apply_snapshot(1, [1], (balances, sum(balances)))
+    return time.perf_counter() - start
+
+
+def run_morpho_snapshot(scale: int) -> float:
+    rng = random.Random(scale)
+    positions = [
+        ("0x" + rng.randbytes(32).hex(), user)
+        for user in get_addresses(POSITIONS * scale, rng)
+    ]
+    responses = [
+        (
+            True,
+            encode(["uint256", "uint128", "uint128"], [0, 0, rng.randint(0, 10**18)]),
+        )
+        for _ in positions
+    ]
+    service = MorphoService.__new__(MorphoService)
+    service.morpho = POOL
+    service.positions = positions
+    service.verifier = Verifier("off")
+
+    start = time.perf_counter()
+    service.apply_snapshot(1, [1], responses)
+    return time.perf_counter() - start
+
+
+def run_merkle(scale: int) -> float:
+    rng = random.Random(scale)
+    users = get_addresses(HOLDERS * scale, rng)
+    balances = [rng.randint(1, 10**24) for _ in users]
+
+    start = time.perf_counter()
+    generate_merkle_tree(users, balances, REWARD_TOKEN)
+    return time.perf_counter() - start
+
+
+def run(scales):
+    benchmarks = [
+        ("accumulation", run_accumulation),
+        ("velodrome v3 snapshot", run_v3_snapshot),
+        ("velodrome v3 delta snapshot", run_v3_delta_snapshot),
+        ("velodrome v2 snapshot", run_v2_snapshot),
+        ("morpho snapshot", run_morpho_snapshot),
+        ("merkle tree", run_merkle),
+    ]
+    for scale in scales:
+        print(
+            "scale x{} ({} holders, {} positions):".format(
+                scale, HOLDERS * scale, POSITIONS * scale
+            )
+        )
+        for name, benchmark in benchmarks:
+            print("  {}: {:.3f}s".format(name, benchmark(scale)))
+
+
+if __name__ == "__main__":
+    run([int(x) for x in sys.argv[1:]] or [1, 10, 100])
@@ -1,10 +1,81 @@
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
 from utils.common import *
+from utils.engine import (
+    SHARDS,
+    accumulate_balances,
+    accumulate_shard,
+    get_change_points,
+    get_shard_bounds,
+    merge_balances,
+)
+from utils.checkpoint import get_checkpoint_file, CHECKPOINT_RESUME
+from utils.profiling import PROFILE_REPORT, profile_call
+from utils.columnar import get_distribution_path, write_distribution
 
-from services.velodrome_v2_service import create_velodrome_v2_service
-from services.velodrome_v3_service import create_velodrome_v3_service
-from services.morpho_service import create_morpho_service
+from services.velodrome_v2_service import (
+    create_velodrome_v2_service,
+    get_velodrome_v2_event_scans,
+)
+from services.velodrome_v3_service import (
+    create_velodrome_v3_service,
+    get_velodrome_v3_event_scans,
+)
+from services.morpho_service import create_morpho_service, get_morpho_event_scans
 from services import constants
 
+service_mapping = {
+    constants.VELODROME_V2: create_velodrome_v2_service,
+    constants.VELODROME_V3: create_velodrome_v3_service,
+    constants.MORPHO: create_morpho_service,
+}
+event_scan_mapping = {
+    constants.VELODROME_V2: get_velodrome_v2_event_scans,
+    constants.VELODROME_V3: get_velodrome_v3_event_scans,
+    constants.MORPHO: get_morpho_event_scans,
+}
+
+
+def get_event_scans(
+    vault: str, service_init_params: List[Tuple[str, List[Any]]]
+) -> List[EventScan]:
+    # the vault transfers and the event histories the services are built from
+    scans = [("token_transfers", vault, None)]
+    for service_type, service_data in service_init_params:
+        scans.extend(event_scan_mapping[service_type](*service_data))
+    return scans
+
+
+def create_services(
+    vault: str, service_init_params: List[Tuple[str, List[Any]]]
+) -> List[DeFiService]:
+    services: List[DeFiService] = []
+    for service_type, service_data in service_init_params:
+        with profiler.stage("create_" + service_type):
+            services.append(service_mapping[service_type](w3, vault, *service_data))
+    return services
+
+
+def calculate_shard(
+    vault: str,
+    transfers: List[Dict[str, Any]],
+    services: List[DeFiService],
+    from_block: int,
+    to_block: int,
+    start: int,
+    stop: int,
+    write_logs: bool,
+) -> Tuple[Dict[str, int], Dict[str, Any]]:
+    # runs in its own process on copies of the services the parent built.
+    # The profiler report of the shard is returned for the parent to
+    # merge, a worker process can run several
+    profiler.reset()
+    cumulative_balances = accumulate_shard(
+        vault, transfers, services, from_block, to_block, start, stop, write_logs
+    )
+    return cumulative_balances, profiler.get_report()
+
 
 def calculate_rewards(
     vault: str,
@@ -15,11 +86,16 @@ def calculate_rewards(
     reward_amount: int,
     label: str,
     write_logs: bool = False,
+    resume: bool = CHECKPOINT_RESUME,
+    shards: int = SHARDS,
 ) -> None:
-    print(f"Collecting vault ({vault}) transfer events...")
-    responses = call_blockscout_api(
-        f"https://blockscout.lisk.com/api/v2/tokens/{vault}/transfers"
-    )
+    # checkpoints are only written by single process runs
+    if resume and shards > 1:
+        raise ValueError("calculate_rewards: resume needs shards=1")
+    print(f"Collecting vault ({vault}) events...")
+    with profiler.stage("event_scans"):
+        event_source.prefetch(get_event_scans(vault, service_init_params))
+    responses = event_source.token_transfers(vault)
     transfers = sorted(
         list(
             map(
@@ -35,78 +111,48 @@ def calculate_rewards(
         key=lambda x: x["block_number"],
     )
 
-    service_mapping = {
-        constants.VELODROME_V2: create_velodrome_v2_service,
-        constants.VELODROME_V3: create_velodrome_v3_service,
-        constants.MORPHO: create_morpho_service,
-    }
-
     print("Creating services...")
-    services: List[DeFiService] = []
-    for service_type, service_data in service_init_params:
-        services.append(service_mapping[service_type](w3, vault, *service_data))
-
-    cumulative_balances = {}
-    user_balances = {}
-    iterator = 0
-    print("Processing...")
-
-    for block_number in range(from_block, to_block + 1):
-        while (
-            iterator < len(transfers)
-            and transfers[iterator]["block_number"] <= block_number
-        ):
-            transfer = transfers[iterator]
-            iterator += 1
-            sender = transfer["from"]
-            receiver = transfer["to"]
-            if sender != ZERO_ADDRESS:
-                user_balances[sender] = (
-                    user_balances.get(sender, 0) - transfer["amount"]
-                )
-            if receiver != ZERO_ADDRESS:
-                user_balances[receiver] = (
-                    user_balances.get(receiver, 0) + transfer["amount"]
-                )
+    services = create_services(vault, service_init_params)
 
-        if block_number >= from_block:
-            run_checks = (
-                block_number - from_block
-            ) % 5000 == 0 or block_number == to_block
-            if run_checks:
-                print("Processing {} / {}...".format(block_number, to_block))
-                onchain_balances, total_supply = get_token_balances_onchain(
-                    vault, list(user_balances.keys()), block_number
-                )
-                if sum(onchain_balances) != total_supply:
-                    raise Exception("total supply != sum(onchain balances)")
-                for index, (user, balance) in enumerate(user_balances.items()):
-                    if onchain_balances[index] != balance:
-                        raise Exception("user balance != onchain user balance")
-
-            defi_pool_shares = {}
-            for service in services:
-                defi_pool, distributions = service.calculate_distributions_with_logs(
-                    block_number, write_logs
+    if shards > 1:
+        points = get_change_points(transfers, services, from_block, to_block)
+        bounds = get_shard_bounds(points, shards)
+        print("Processing {} shards...".format(len(bounds)))
+        with ProcessPoolExecutor(
+            len(bounds), mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            futures = [
+                executor.submit(
+                    calculate_shard,
+                    vault,
+                    transfers,
+                    services,
+                    from_block,
+                    to_block,
+                    start,
+                    stop,
+                    write_logs,
                 )
-                defi_pool_shares[defi_pool] = distributions
-
-            for holder, balance in user_balances.items():
-                if holder in defi_pool_shares:
-                    distributions = defi_pool_shares[holder]
-                    total_defi_shares = sum(
-                        [defi_shares for _, defi_shares in distributions]
-                    )
-                    for defi_user, defi_shares in distributions:
-                        if defi_user not in cumulative_balances:
-                            cumulative_balances[defi_user] = 0
-                        cumulative_balances[defi_user] += (
-                            balance * defi_shares // total_defi_shares
-                        )
-                else:
-                    if holder not in cumulative_balances:
-                        cumulative_balances[holder] = 0
-                    cumulative_balances[holder] += balance
+                for start, stop in bounds
+            ]
+            partials = []
+            for future in futures:
+                partial, report = future.result()
+                profiler.merge(report)
+                partials.append(partial)
+            cumulative_balances = merge_balances(partials)
+    else:
+        print("Processing...")
+        cumulative_balances = accumulate_balances(
+            vault,
+            transfers,
+            services,
+            from_block,
+            to_block,
+            write_logs,
+            checkpoint_file=get_checkpoint_file(vault, from_block, to_block),
+            resume=resume,
+        )
 
     del cumulative_balances[Web3.to_checksum_address(withdrawal_queue)]
 
@@ -134,6 +180,54 @@ def calculate_rewards(
         writer.writerow(["user", "reward"])
         for user, amount in rewards:
             writer.writerow([user, amount])
+    write_distribution(get_distribution_path(label, vault), rewards)
+
+
+def calculate_rewards_batch(
+    vault_configs: List[Dict[str, Any]], max_workers: int = None
+) -> None:
+    # the vault threads run under a single cProfile of the whole batch
+    profile_call(
+        "calculate_rewards_batch",
+        _calculate_rewards_batch,
+        vault_configs,
+        max_workers,
+    )
+
+
+def _calculate_rewards_batch(
+    vault_configs: List[Dict[str, Any]], max_workers: int = None
+) -> None:
+    # vaults are processed concurrently; services that point to the same
+    # protocol contract share their fetched state via get_shared_state
+    # and identical historical reads are served by the rpc cache. The
+    # event histories of every vault are scanned concurrently up front
+    print("Collecting events...")
+    with profiler.stage("event_scans"):
+        event_source.prefetch(
+            [
+                scan
+                for vault_config in vault_configs
+                for scan in get_event_scans(
+                    vault_config["vault"], vault_config["service_init_params"]
+                )
+            ]
+        )
+    with ThreadPoolExecutor(max_workers or len(vault_configs)) as executor:
+        futures = [
+            executor.submit(calculate_rewards, **vault_config)
+            for vault_config in vault_configs
+        ]
+        errors = []
+        for vault_config, future in zip(vault_configs, futures):
+            try:
+                future.result()
+            except Exception as e:
+                errors.append("{}: {}".format(vault_config["vault"], e))
+    if PROFILE_REPORT is not None:
+        profiler.write_report(PROFILE_REPORT)
+    if errors:
+        raise Exception("calculate_rewards_batch: " + "; ".join(errors))
 
 
 if __name__ == "__main__":
@@ -141,73 +235,93 @@ if __name__ == "__main__":
     to_block = 20182404
 
     label = "./distributions/lisk/4/local"
-    calculate_rewards(
-        "0x1b10E2270780858923cdBbC9B5423e29fffD1A44",
-        "0x5E3584d67b86f0C77FB43073A1238a943CA26188",
+    calculate_rewards_batch(
         [
-            (constants.VELODROME_V2, ["0xDcb60949A0cCFc813A0D8dF8e8Ebcac097a1A9d1"]),
-            (
-                constants.VELODROME_V3,
-                [
-                    "0x9788ABD076014dE9c04A2283c709BfF7778a6cF1",
-                    "0xcf3c93f6FAb70b39F862ceD14A7c84e6aE319328",
-                    to_block,
+            {
+                "vault": "0x1b10E2270780858923cdBbC9B5423e29fffD1A44",
+                "withdrawal_queue": "0x5E3584d67b86f0C77FB43073A1238a943CA26188",
+                "service_init_params": [
+                    (
+                        constants.VELODROME_V2,
+                        ["0xDcb60949A0cCFc813A0D8dF8e8Ebcac097a1A9d1"],
+                    ),
+                    (
+                        constants.VELODROME_V3,
+                        [
+                            "0x9788ABD076014dE9c04A2283c709BfF7778a6cF1",
+                            "0xcf3c93f6FAb70b39F862ceD14A7c84e6aE319328",
+                            to_block,
+                        ],
+                    ),
+                    (
+                        constants.MORPHO,
+                        [
+                            "0x00cD58DEEbd7A2F1C55dAec715faF8aed5b27BF8",
+                            from_block,
+                            to_block,
+                        ],
+                    ),
                 ],
-            ),
-            (
-                constants.MORPHO,
-                ["0x00cD58DEEbd7A2F1C55dAec715faF8aed5b27BF8", from_block, to_block],
-            ),
-        ],
-        from_block,
-        to_block,
-        4000,
-        label,
-    )
-
-    calculate_rewards(
-        "0xa67E8B2E43B70D98E1896D3f9d563f3ABdB8Adcd",
-        "0x8294c6B7ed0dEf4Bcf0c1a34c9A09Fe0880D8A13",
-        [
-            (constants.VELODROME_V2, ["0x7d8a904165ee7D6DcD70d2680D713C2984473B45"]),
-            (
-                constants.VELODROME_V3,
-                [
-                    "0x9665Df2b69163411D9b089F6C192F8CeB579FB57",
-                    "0x7a0CA233A1599a1b1d23563326a4C560Ef1f4B33",
-                    to_block,
+                "from_block": from_block,
+                "to_block": to_block,
+                "reward_amount": 4000,
+                "label": label,
+            },
+            {
+                "vault": "0xa67E8B2E43B70D98E1896D3f9d563f3ABdB8Adcd",
+                "withdrawal_queue": "0x8294c6B7ed0dEf4Bcf0c1a34c9A09Fe0880D8A13",
+                "service_init_params": [
+                    (
+                        constants.VELODROME_V2,
+                        ["0x7d8a904165ee7D6DcD70d2680D713C2984473B45"],
+                    ),
+                    (
+                        constants.VELODROME_V3,
+                        [
+                            "0x9665Df2b69163411D9b089F6C192F8CeB579FB57",
+                            "0x7a0CA233A1599a1b1d23563326a4C560Ef1f4B33",
+                            to_block,
+                        ],
+                    ),
+                    (
+                        constants.MORPHO,
+                        [
+                            "0x00cD58DEEbd7A2F1C55dAec715faF8aed5b27BF8",
+                            from_block,
+                            to_block,
+                        ],
+                    ),
                 ],
-            ),
-            (
-                constants.MORPHO,
-                ["0x00cD58DEEbd7A2F1C55dAec715faF8aed5b27BF8", from_block, to_block],
-            ),
-        ],
-        from_block,
-        to_block,
-        8000,
-        label,
-    )
-
-    calculate_rewards(
-        "0x8cf94b5A37b1835D634b7a3e6b1EE02Ce7F0CD30",
-        "0x025e059BCea0eAdBb58b16db7D2e5748736F6511",
-        [
-            (
-                constants.VELODROME_V3,
-                [
-                    "0xFF457eFE9A906CB4af830C22c2B36f15a9a77619",
-                    "0xD3AD131b12699c464dFD461a5FcE225F2C2e410b",
-                    to_block,
+                "from_block": from_block,
+                "to_block": to_block,
+                "reward_amount": 8000,
+                "label": label,
+            },
+            {
+                "vault": "0x8cf94b5A37b1835D634b7a3e6b1EE02Ce7F0CD30",
+                "withdrawal_queue": "0x025e059BCea0eAdBb58b16db7D2e5748736F6511",
+                "service_init_params": [
+                    (
+                        constants.VELODROME_V3,
+                        [
+                            "0xFF457eFE9A906CB4af830C22c2B36f15a9a77619",
+                            "0xD3AD131b12699c464dFD461a5FcE225F2C2e410b",
+                            to_block,
+                        ],
+                    ),
+                    (
+                        constants.MORPHO,
+                        [
+                            "0x00cD58DEEbd7A2F1C55dAec715faF8aed5b27BF8",
+                            from_block,
+                            to_block,
+                        ],
+                    ),
                 ],
-            ),
-            (
-                constants.MORPHO,
-                ["0x00cD58DEEbd7A2F1C55dAec715faF8aed5b27BF8", from_block, to_block],
-            ),
-        ],
-        from_block,
-        to_block,
-        500,
-        label,
+                "from_block": from_block,
+                "to_block": to_block,
+                "reward_amount": 500,
+                "label": label,
+            },
+        ]
     )
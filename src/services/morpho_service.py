@@ -1,5 +1,4 @@
 from utils.common import *
-import json
 
 
 class MorphoService(DeFiService):
@@ -17,39 +16,38 @@ class MorphoService(DeFiService):
         self.positions = positions
         self.block_numbers = block_numbers
         self.iterator = 0
-        self.cached_block_number = 0
+        self.cached_block_number = None
         self.cached_distributions = []
+        self.multicall = multicall_executor
 
     def name(self) -> str:
         return "MorphoService"
 
-    def calculate_distributions(
-        self, block_number: int
-    ) -> Tuple[str, List[Tuple[str, int]]]:
-        flag = False
-        while (
-            self.iterator < len(self.block_numbers)
-            and self.block_numbers[self.iterator] <= block_number
-        ):
-            flag = True
-            self.iterator += 1
-
-        if not flag:
-            return self.morpho, self.cached_distributions
-
-        multi_call: Contract = self.w3.eth.contract(
-            address=MULTICALL_ADDRESS, abi=MULTICALL_ABI
-        )
+    def connect(self) -> None:
+        super().connect()
+        self.multicall = multicall_executor
 
+    def fetch_snapshot(
+        self,
+        block_number: int,
+        consumed_block_numbers: List[int],
+        previous_block_number: Optional[int],
+    ) -> List[Tuple[bool, bytes]]:
         calls = []
         for position in self.positions:
             market_id, user_address = position
             calls.append(
                 [self.morpho, "0x93c52062" + market_id[2:] + user_address[2:].zfill(64)]
             )
-        results = multi_call.functions.tryAggregate(False, calls).call(
-            block_identifier=block_number
-        )
+        return self.multicall.try_aggregate(calls, block_number)
+
+    def apply_snapshot(
+        self,
+        block_number: int,
+        consumed_block_numbers: List[int],
+        snapshot: List[Tuple[bool, bytes]],
+    ) -> Tuple[str, List[Tuple[str, int]]]:
+        results = snapshot
         positions = []
         cumulative_value = 0
         for index, result in enumerate(results):
@@ -60,33 +58,41 @@ class MorphoService(DeFiService):
             positions.append((self.positions[index][1], collateral))
             cumulative_value += collateral
 
-        balances, _ = get_token_balances_onchain(
-            self.vault, [self.morpho], block_number
+        self.verify(
+            block_number,
+            lambda: self.check_collateral(block_number, cumulative_value),
         )
-        if balances[0] != cumulative_value:
-            raise Exception(
-                "MorphoService: vault.balanceOf(morpho) != sum(position.collateral)"
-            )
 
         self.cached_distributions = positions
         self.cached_block_number = block_number
         return self.morpho, self.cached_distributions
 
+    def check_collateral(self, block_number: int, cumulative_value: int) -> List[str]:
+        balances, _ = get_token_balances_onchain(
+            self.vault, [self.morpho], block_number
+        )
+        if balances[0] != cumulative_value:
+            return ["vault.balanceOf(morpho) != sum(position.collateral)"]
+        return []
 
-def collect_morpho_events(morpho: str):
-    file_name = "./src/services/morpho_cached_events.json"
-    data: List[Any] = json.load(open(file_name, "r"))
-    max_recorded_block_number = 0
-    for item in data:
-        max_recorded_block_number = max(
-            max_recorded_block_number, int(item["block_number"])
+    def calculate_distributions(
+        self, block_number: int
+    ) -> Tuple[str, List[Tuple[str, int]]]:
+        consumed_block_numbers = self.consume_block_numbers(block_number)
+        if not consumed_block_numbers:
+            return self.morpho, self.cached_distributions
+        snapshot = self.timed_fetch_snapshot(
+            block_number, consumed_block_numbers, self.cached_block_number
         )
-    url = f"https://blockscout.lisk.com/api/v2/addresses/{morpho}/logs"
-    responses = call_blockscout_api(
-        url, limit_function=lambda x: x[0]["block_number"] <= max_recorded_block_number
-    )
+        return self.timed_apply_snapshot(block_number, consumed_block_numbers, snapshot)
 
+
+def collect_morpho_events(morpho: str):
+    responses = event_source.logs(morpho, MORPHO_ABI)
+    data: List[Any] = []
     for response in responses:
+        if not response["decoded"]:
+            continue
         data.append(
             {
                 "address": response["address"]["hash"],
@@ -98,16 +104,21 @@ def collect_morpho_events(morpho: str):
                 },
             }
         )
-
-    with open(file_name, "w") as f:
-        json.dump(data, f, indent=2)
     return data
 
 
+def get_morpho_event_scans(
+    morpho: str, from_block: int, to_block: int
+) -> List[EventScan]:
+    return [("logs", morpho, MORPHO_ABI)]
+
+
 def create_morpho_service(
     w3: Web3, vault: str, morpho: str, from_block: int, to_block: int
 ):
-    data = collect_morpho_events(morpho)
+    data = get_shared_state(
+        ("morpho_events", morpho), lambda: collect_morpho_events(morpho)
+    )
 
     market_ids = set()
     for item in data:
@@ -16,29 +16,35 @@ class VelodromeV2Service(DeFiService):
         self.users = users
         self.block_numbers = block_numbers
         self.iterator = 0
+        self.cached_block_number = None
         self.cached_distributions = []
 
     def name(self) -> str:
         return "VelodromeV2Service"
 
-    def calculate_distributions(
-        self, block_number: int
-    ) -> Tuple[str, List[Tuple[str, int]]]:
-        flag = False
-        while (
-            self.iterator < len(self.block_numbers)
-            and self.block_numbers[self.iterator] <= block_number
-        ):
-            self.iterator += 1
-            flag = True
-        if not flag:
-            return self.pool, self.cached_distributions
+    def fetch_snapshot(
+        self,
+        block_number: int,
+        consumed_block_numbers: List[int],
+        previous_block_number: Optional[int],
+    ) -> Tuple[List[int], int]:
+        return get_token_balances_onchain(self.pool, self.users, block_number)
 
-        lp_balances, total_supply = get_token_balances_onchain(
-            self.pool, self.users, block_number
+    def apply_snapshot(
+        self,
+        block_number: int,
+        consumed_block_numbers: List[int],
+        snapshot: Tuple[List[int], int],
+    ) -> Tuple[str, List[Tuple[str, int]]]:
+        lp_balances, total_supply = snapshot
+        self.verify(
+            block_number,
+            lambda: (
+                []
+                if sum(lp_balances) == total_supply
+                else ["sum(balances) != total_supply"]
+            ),
         )
-        if sum(lp_balances) != total_supply:
-            raise Exception("VelodromeV2Service: sum(balances) != total_supply")
         self.cached_block_number = block_number
         self.cached_distributions = list(
             filter(
@@ -54,15 +60,30 @@ class VelodromeV2Service(DeFiService):
         )
         return self.pool, self.cached_distributions
 
+    def calculate_distributions(
+        self, block_number: int
+    ) -> Tuple[str, List[Tuple[str, int]]]:
+        consumed_block_numbers = self.consume_block_numbers(block_number)
+        if not consumed_block_numbers:
+            return self.pool, self.cached_distributions
+        snapshot = self.timed_fetch_snapshot(
+            block_number, consumed_block_numbers, self.cached_block_number
+        )
+        return self.timed_apply_snapshot(block_number, consumed_block_numbers, snapshot)
+
+
+def get_velodrome_v2_event_scans(pool: str) -> List[EventScan]:
+    return [("logs", pool, VELO_V2_POOL_ABI)]
+
 
 def create_velodrome_v2_service(w3: Web3, vault: str, pool: str) -> VelodromeV2Service:
-    responses = call_blockscout_api(
-        f"https://blockscout.lisk.com/api/v2/addresses/{pool}/logs"
-    )
+    responses = event_source.logs(pool, VELO_V2_POOL_ABI)
     block_numbers = set()
     users = set()
     for response in responses:
         block_numbers.add(int(response["block_number"]))
+        if not response["decoded"]:
+            continue
         if response["decoded"]["method_call"].startswith("Transfer"):
             for parameter in response["decoded"]["parameters"]:
                 if parameter["name"] in ["from", "to"]:
@@ -1,66 +1,167 @@
+from bisect import bisect_right
+
 from utils.common import *
+from utils.position_store import PositionStore
 
+# seeds the position store on its first use
 _CACHE_PATH = "./src/services/velodrome_v3_cached_positions.csv"
 
+# shared by all vaults, since every pool is backed by the same position manager
+_next_token_id_cache: Dict[int, int] = {}
+_positions_lock = threading.Lock()
+
 
 class VelodromeV3Service(DeFiService):
+    state_attributes = DeFiService.state_attributes + [
+        "owners",
+        "amounts",
+        "staked_owners",
+    ]
+
     def __init__(
         self,
         w3: Web3,
         vault: str,
         pool: str,
         gauge: str,
-        users: List[str],
+        token0: str,
+        users: Dict[str, int],
         token_ids: List[int],
+        token_ranges: Dict[int, Tuple[int, Optional[int]]],
+        ticks: Dict[int, Tuple[int, int]],
         block_numbers: List[int],
+        nft_transfers: Dict[int, List[Tuple[int, str, str]]],
+        pool_event_ticks: Dict[int, Optional[Set[Tuple[int, int]]]],
     ):
         self.w3 = w3
         self.vault = vault
         self.pool = pool
         self.gauge = gauge
         self.token_ids = token_ids
+        # token id -> (minting block, burning block or None)
+        self.token_ranges = token_ranges
+        # gauge staker -> block of the first deposit
         self.users = users
         self.block_numbers = block_numbers
+        self.nft_transfers = nft_transfers
+        self.pool_event_ticks = pool_event_ticks
+        # token id -> (tickLower, tickUpper)
+        self.ticks = ticks
         self.cached_distributions = []
+        self.cached_block_number = None
         self.iterator = 0
+        # per-position state, refreshed only for positions touched by events
+        self.owners: Dict[int, Optional[str]] = {}
+        self.amounts: Dict[int, int] = {}
+        self.staked_owners: Dict[int, str] = {}
         self.pool_contract: Contract = self.w3.eth.contract(
             address=pool, abi=VELO_V3_POOL_ABI
         )
-        self.token_index = (
-            0
-            if self.pool_contract.functions.token0().call().lower()
-            == self.vault.lower()
-            else 1
-        )
-        self.multi_call: Contract = self.w3.eth.contract(
-            address=MULTICALL_ADDRESS, abi=MULTICALL_ABI
-        )
+        self.token_index = 0 if token0.lower() == self.vault.lower() else 1
+        self.multicall = multicall_executor
 
     def name(self) -> str:
         return "VelodromeV3Service"
 
-    def calculate_distributions(self, block_number: int) -> List[Tuple[str, int]]:
-        flag = False
-        while (
-            self.iterator < len(self.block_numbers)
-            and self.block_numbers[self.iterator] <= block_number
-        ):
-            flag = True
-            self.iterator += 1
-
-        if not flag:
-            return self.pool, self.cached_distributions
+    def connect(self) -> None:
+        super().connect()
+        self.pool_contract = self.w3.eth.contract(
+            address=self.pool, abi=VELO_V3_POOL_ABI
+        )
+        self.multicall = multicall_executor
+
+    def is_alive(self, token_id: int, block_number: int) -> bool:
+        minted_at, burned_at = self.token_ranges[token_id]
+        return minted_at <= block_number and (
+            burned_at is None or block_number < burned_at
+        )
 
+    def get_stakers(self, block_number: int) -> List[str]:
+        return [
+            user for user, staked_at in self.users.items() if staked_at <= block_number
+        ]
+
+    def get_touched_positions(
+        self, block_numbers: List[int]
+    ) -> Tuple[Set[int], List[str], Set[Tuple[int, int]], bool]:
+        transferred_token_ids = set()
+        accounts = set()
+        ticks = set()
+        full_refresh = False
+        for block_number in block_numbers:
+            for token_id, sender, receiver in self.nft_transfers.get(block_number, []):
+                transferred_token_ids.add(token_id)
+                accounts.add(sender)
+                accounts.add(receiver)
+            if block_number in self.pool_event_ticks:
+                if self.pool_event_ticks[block_number] is None:
+                    full_refresh = True
+                else:
+                    ticks |= self.pool_event_ticks[block_number]
+        stakers = [user for user in self.users if user in accounts]
+        return transferred_token_ids, stakers, ticks, full_refresh
+
+    def fetch_snapshot(
+        self,
+        block_number: int,
+        consumed_block_numbers: List[int],
+        previous_block_number: Optional[int],
+    ) -> Dict[str, Any]:
         sqrt_price_x96 = self.pool_contract.functions.slot0().call(
             block_identifier=block_number
         )[0]
 
-        # fees + principals + owners
+        if previous_block_number is None:
+            owner_token_ids = [
+                token_id
+                for token_id in self.token_ids
+                if self.is_alive(token_id, block_number)
+            ]
+            amount_token_ids = owner_token_ids
+            burned_token_ids = []
+            stakers = self.get_stakers(block_number)
+        else:
+            # owners only change with nft transfers (mint, burn, transfer,
+            # gauge deposit/withdraw); fees and principals of other positions
+            # only change when the price moves or fees are accrued pool-wide
+            transferred_token_ids, stakers, ticks, full_refresh = (
+                self.get_touched_positions(consumed_block_numbers)
+            )
+            full_refresh = (
+                full_refresh
+                or sqrt_price_x96
+                != self.pool_contract.functions.slot0().call(
+                    block_identifier=previous_block_number
+                )[0]
+            )
+            owner_token_ids = []
+            burned_token_ids = []
+            for token_id in self.token_ids:
+                if token_id not in transferred_token_ids:
+                    continue
+                if self.is_alive(token_id, block_number):
+                    owner_token_ids.append(token_id)
+                else:
+                    # burned, no need to ask the position manager
+                    burned_token_ids.append(token_id)
+            amount_token_ids = [
+                token_id
+                for token_id in self.token_ids
+                if self.is_alive(token_id, block_number)
+                and (
+                    token_id in transferred_token_ids
+                    or full_refresh
+                    or self.ticks.get(token_id) in ticks
+                )
+            ]
+
         calls = []
-        for token_id in self.token_ids:
+        for token_id in owner_token_ids:
             calls.append(
                 [VELO_V3_POSITION_MANAGER, "0x6352211e" + hex(token_id)[2:].zfill(64)]
             )
+        # fees + principals
+        for token_id in amount_token_ids:
             calls.append(
                 [
                     SUGAR_ADDRESS,
@@ -78,33 +179,48 @@ class VelodromeV3Service(DeFiService):
                     + hex(sqrt_price_x96)[2:].zfill(64),
                 ]
             )
-
-        for account in self.users:
+        for account in stakers:
             calls.append([self.gauge, "0x4b937763" + account[2:].zfill(64)])
 
-        responses = self.multi_call.functions.tryAggregate(False, calls).call(
-            block_identifier=block_number
-        )
+        return {
+            "owner_token_ids": owner_token_ids,
+            "amount_token_ids": amount_token_ids,
+            "burned_token_ids": burned_token_ids,
+            "stakers": stakers,
+            "responses": self.multicall.try_aggregate(calls, block_number),
+        }
 
-        owner_of_staked = {}
-        for i, user in enumerate(self.users):
-            response = responses[i + len(self.token_ids) * 3]
-            if not response[0]:
-                continue
-            staked_token_ids = decode(["uint256[]"], response[1])
-            for token_ids in staked_token_ids:
-                for token_id in token_ids:
-                    owner_of_staked[token_id] = user
-
-        balances = {}
-        for index, token_id in enumerate(self.token_ids):
-            owner_response = responses[index * 3]
+    def apply_snapshot(
+        self,
+        block_number: int,
+        consumed_block_numbers: List[int],
+        snapshot: Dict[str, Any],
+    ) -> Tuple[str, List[Tuple[str, int]]]:
+        responses = snapshot["responses"]
+
+        for token_id in snapshot["burned_token_ids"]:
+            self.owners[token_id] = None
+            self.amounts.pop(token_id, None)
+
+        offset = 0
+        for token_id in snapshot["owner_token_ids"]:
+            owner_response = responses[offset]
+            offset += 1
             if not owner_response[0]:
                 # nft does not exist
+                self.owners[token_id] = None
                 continue
+            self.owners[token_id] = Web3.to_checksum_address(
+                decode(["address"], owner_response[1])[0]
+            )
 
-            fee_response = responses[index * 3 + 1]
-            principal_response = responses[index * 3 + 2]
+        for token_id in snapshot["amount_token_ids"]:
+            fee_response = responses[offset]
+            principal_response = responses[offset + 1]
+            offset += 2
+            if self.owners.get(token_id) is None:
+                self.amounts.pop(token_id, None)
+                continue
             if not fee_response[0] or not principal_response[0]:
                 raise Exception(
                     "VelodromeV3Service: SugarHeler call fails at tokenId={}, blockNumber={}".format(
@@ -114,14 +230,32 @@ class VelodromeV3Service(DeFiService):
                 )
             fees = decode(["uint256", "uint256"], fee_response[1])
             principals = decode(["uint256", "uint256"], principal_response[1])
-            amount = fees[self.token_index] + principals[self.token_index]
-            owner = Web3.to_checksum_address(decode(["address"], owner_response[1])[0])
+            self.amounts[token_id] = (
+                fees[self.token_index] + principals[self.token_index]
+            )
+
+        for account in snapshot["stakers"]:
+            response = responses[offset]
+            offset += 1
+            if not response[0]:
+                continue
+            staked_token_ids = decode(["uint256[]"], response[1])
+            for token_ids in staked_token_ids:
+                for token_id in token_ids:
+                    self.staked_owners[token_id] = account
+
+        balances = {}
+        for token_id in self.token_ids:
+            owner = self.owners.get(token_id)
+            if owner is None:
+                continue
             if owner == self.gauge:
-                owner = owner_of_staked[token_id]
+                owner = self.staked_owners[token_id]
             if owner not in balances:
                 balances[owner] = 0
-            balances[owner] += amount
+            balances[owner] += self.amounts[token_id]
 
+        self.cached_block_number = block_number
         self.cached_distributions = list(
             filter(
                 lambda item: item[1] > 0,
@@ -130,24 +264,14 @@ class VelodromeV3Service(DeFiService):
         )
         return self.pool, self.cached_distributions
 
-
-def get_next_token_id_at(w3: Web3, cache: Dict[int, int], block_number: int) -> int:
-    value = cache.get(block_number, 0)
-    if not value:
-        value = cache.get(
-            block_number,
-            int(
-                w3.eth.get_storage_at(
-                    VELO_V3_POSITION_MANAGER,
-                    0x000000000000000000000000000000000000000000000000000000000000000F,
-                    block_identifier=block_number,
-                ).hex(),
-                16,
-            )
-            % (1 << 176),
+    def calculate_distributions(self, block_number: int) -> List[Tuple[str, int]]:
+        consumed_block_numbers = self.consume_block_numbers(block_number)
+        if not consumed_block_numbers:
+            return self.pool, self.cached_distributions
+        snapshot = self.timed_fetch_snapshot(
+            block_number, consumed_block_numbers, self.cached_block_number
         )
-        cache[block_number] = value
-    return value
+        return self.timed_apply_snapshot(block_number, consumed_block_numbers, snapshot)
 
 
 def convert_positions_response(token_id, response):
@@ -173,14 +297,15 @@ def convert_positions_response(token_id, response):
         "token0": position[2],
         "token1": position[3],
         "tickSpacing": position[4],
+        "tickLower": position[5],
+        "tickUpper": position[6],
     }
 
 
 def get_onchain_positions(
-    multi_call: Contract, block_numbers: List[int], missing_token_ids: Set[int]
+    multicall: MulticallExecutor, block_numbers: List[int], missing_token_ids: Set[int]
 ) -> Dict[int, Any]:
     block_numbers = sorted(list(set(block_numbers)))
-    multi_call: Contract = w3.eth.contract(address=MULTICALL_ADDRESS, abi=MULTICALL_ABI)
     calls = []
     call_token_ids = []
     for token_id in missing_token_ids:
@@ -193,14 +318,7 @@ def get_onchain_positions(
         call_token_ids.append(token_id)
     positions = dict()
     for block_number in block_numbers:
-        responses = []
-        step = 1000
-        for i in range(0, len(calls), step):
-            responses.extend(
-                multi_call.functions.tryAggregate(False, calls[i : i + step]).call(
-                    block_identifier=block_number
-                )
-            )
+        responses = multicall.try_aggregate(calls, block_number)
         for index, response in enumerate(responses):
             if response[0]:
                 token_id = call_token_ids[index]
@@ -209,123 +327,223 @@ def get_onchain_positions(
     return positions
 
 
-def get_minting_block_number(
-    w3: Web3, cache: Dict[int, int], from_block: int, to_block: int, token_id: int
-) -> int:
-    left = from_block
-    right = to_block
-    mid = 0
-    answer = right
-    while left <= right:
-        mid = (left + right) >> 1
-        next_token_id = get_next_token_id_at(w3, cache, mid)
-        if next_token_id > token_id:
-            answer = mid
-            right = mid - 1
-        else:
-            left = mid + 1
-    return answer
+def probe_next_token_ids(cache: Dict[int, int], block_numbers: List[int]) -> None:
+    block_numbers = sorted(
+        [
+            block_number
+            for block_number in set(block_numbers)
+            if not cache.get(block_number, 0)
+        ]
+    )
+    responses = call_rpc_batch(
+        [
+            (
+                "eth_getStorageAt",
+                [VELO_V3_POSITION_MANAGER, hex(0xF), hex(block_number)],
+            )
+            for block_number in block_numbers
+        ]
+    )
+    for block_number, (success, result) in zip(block_numbers, responses):
+        if not success:
+            raise Exception(
+                "VelodromeV3Service: eth_getStorageAt fails at blockNumber={}: {}".format(
+                    block_number, result
+                )
+            )
+        cache[block_number] = int(result, 16) % (1 << 176)
+
+
+def get_minting_block_numbers(
+    cache: Dict[int, int], from_block: int, to_block: int, token_ids: List[int]
+) -> Dict[int, int]:
+    # one binary search shared by all token ids: every level probes the
+    # midpoints of all open windows in a single batch, and since the next
+    # token id only grows, every probe narrows the windows of the other ids
+    windows = {token_id: (from_block, to_block, to_block) for token_id in token_ids}
+    while True:
+        probes = sorted(
+            (block_number, value)
+            for block_number, value in cache.items()
+            if value and from_block <= block_number <= to_block
+        )
+        values = [value for _, value in probes]
+        mids = set()
+        for token_id in token_ids:
+            left, right, answer = windows[token_id]
+            index = bisect_right(values, token_id)
+            if index > 0:
+                left = max(left, probes[index - 1][0] + 1)
+            if index < len(probes) and probes[index][0] <= answer:
+                answer = probes[index][0]
+                right = min(right, answer - 1)
+            windows[token_id] = (left, right, answer)
+            if left <= right:
+                mids.add((left + right) >> 1)
+        if not mids:
+            break
+        probe_next_token_ids(cache, list(mids))
+    return {token_id: windows[token_id][2] for token_id in token_ids}
+
+
+def is_reverted(error: Any) -> bool:
+    return "revert" in str(error.get("message", "")).lower()
 
 
 def load_all_positions(
-    w3: Web3, cache: Dict[int, int], from_block: int, to_block: int
-) -> Dict[int, Any]:
-    positions = {}
-
-    with open(_CACHE_PATH, "r") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            positions[int(row["tokenId"])] = row
-
-    from_token_id = get_next_token_id_at(w3, cache, from_block - 1)
-    to_token_id = get_next_token_id_at(w3, cache, to_block)
+    w3: Web3,
+    store: PositionStore,
+    cache: Dict[int, int],
+    from_block: int,
+    to_block: int,
+) -> None:
+    probe_next_token_ids(cache, [from_block - 1, to_block])
+    from_token_id = cache[from_block - 1]
+    to_token_id = cache[to_block]
 
-    missing_token_ids = set()
-    for token_id in range(from_token_id, to_token_id):
-        if token_id not in positions:
-            missing_token_ids.add(token_id)
+    missing_token_ids = set(store.get_missing_token_ids(from_token_id, to_token_id))
 
     if not missing_token_ids:
-        return positions
+        return
 
-    multi_call: Contract = w3.eth.contract(address=MULTICALL_ADDRESS, abi=MULTICALL_ABI)
+    positions = []
+
+    # positions that still exist are read at to_block, only the burned ones
+    # need the state at their minting block
     collected_onchain_positions = get_onchain_positions(
-        multi_call,
-        sorted(
-            list(set([randint(from_block, to_block) for _ in range(50)] + [to_block]))
-        ),
-        missing_token_ids,
+        multicall_executor, [to_block], missing_token_ids
     )
 
     for token_id in collected_onchain_positions:
         if token_id in missing_token_ids:
             missing_token_ids.remove(token_id)
-            positions[token_id] = collected_onchain_positions[token_id]
+            positions.append(collected_onchain_positions[token_id])
 
     missing_token_ids = sorted(list(missing_token_ids))
-    missing_token_ids_iterator = 0
-    while missing_token_ids_iterator < len(missing_token_ids):
-        print(
-            "Processing {}/{}...".format(
-                missing_token_ids_iterator + 1, len(missing_token_ids)
+    print("Searching minting blocks of {} positions...".format(len(missing_token_ids)))
+    minting_block_numbers = get_minting_block_numbers(
+        cache, from_block, to_block, missing_token_ids
+    )
+    responses = call_rpc_batch(
+        [
+            (
+                "eth_call",
+                [
+                    {
+                        "to": VELO_V3_POSITION_MANAGER,
+                        "data": "0x99fbab88" + hex(token_id)[2:].zfill(64),
+                    },
+                    hex(minting_block_numbers[token_id]),
+                ],
             )
-        )
-        block_number = get_minting_block_number(
-            w3,
-            cache,
-            from_block,
-            to_block,
-            missing_token_ids[missing_token_ids_iterator],
-        )
-        calls = []
-
-        call_token_ids = []
-        for token_id in range(
-            get_next_token_id_at(w3, cache, block_number - 1),
-            get_next_token_id_at(w3, cache, block_number),
-        ):
-            if missing_token_ids_iterator == len(missing_token_ids):
-                break
-            if token_id == missing_token_ids[missing_token_ids_iterator]:
-                calls.append(
-                    [
-                        VELO_V3_POSITION_MANAGER,
-                        "0x99fbab88" + hex(token_id)[2:].zfill(64),
-                    ]
-                )
-                call_token_ids.append(token_id)
-                missing_token_ids_iterator += 1
-        if not calls:
-            continue
-        responses = multi_call.functions.tryAggregate(False, calls).call(
-            block_identifier=block_number
-        )
-        for index, response in enumerate(responses):
-            token_id = call_token_ids[index]
-            if response[0]:
-                positions[token_id] = convert_positions_response(token_id, response[1])
-            else:
-                positions[token_id] = {
+            for token_id in missing_token_ids
+        ]
+    )
+    for token_id, (success, result) in zip(missing_token_ids, responses):
+        if success:
+            positions.append(
+                convert_positions_response(token_id, bytes.fromhex(result[2:]))
+            )
+        elif is_reverted(result):
+            positions.append(
+                {
                     "tokenId": token_id,
                     "token0": ZERO_ADDRESS,
                     "token1": ZERO_ADDRESS,
                     "tickSpacing": 0,
                 }
+            )
+        else:
+            raise Exception(
+                "VelodromeV3Service: positions call fails at tokenId={}, blockNumber={}: {}".format(
+                    token_id, minting_block_numbers[token_id], result
+                )
+            )
 
-    with open(_CACHE_PATH, "w") as f:
-        writer = csv.writer(f)
-        writer.writerow(["tokenId", "token0", "token1", "tickSpacing"])
-        for position in positions.values():
-            writer.writerow(
+    store.add(positions)
+
+
+def get_event_ticks(event: Dict[str, Any]) -> Optional[Tuple[int, int]]:
+    # liquidity and fee collection events only affect the positions with the
+    # same range; anything else (swaps, flash loans, unknown events) may move
+    # fees or principals of every position and returns None
+    decoded = event.get("decoded")
+    if not decoded:
+        return None
+    method_call = decoded.get("method_call", "").split("(")[0]
+    if method_call not in ["Mint", "Burn", "Collect"]:
+        return None
+    parameters = {item["name"]: item["value"] for item in decoded["parameters"]}
+    if "tickLower" not in parameters or "tickUpper" not in parameters:
+        return None
+    return (int(parameters["tickLower"]), int(parameters["tickUpper"]))
+
+
+def get_position_ticks(
+    token_ids: List[int], token_ranges: Dict[int, Tuple[int, Optional[int]]]
+) -> Dict[int, Tuple[int, int]]:
+    # tick ranges never change, so they are read once at the minting block;
+    # positions burned in the same block are never alive and have none
+    responses = call_rpc_batch(
+        [
+            (
+                "eth_call",
                 [
-                    position["tokenId"],
-                    position["token0"],
-                    position["token1"],
-                    position["tickSpacing"],
-                ]
+                    {
+                        "to": VELO_V3_POSITION_MANAGER,
+                        "data": "0x99fbab88" + hex(token_id)[2:].zfill(64),
+                    },
+                    hex(token_ranges[token_id][0]),
+                ],
             )
+            for token_id in token_ids
+        ]
+    )
+    ticks = {}
+    for token_id, (success, result) in zip(token_ids, responses):
+        if not success:
+            if is_reverted(result):
+                continue
+            raise Exception(
+                "VelodromeV3Service: positions call fails at tokenId={}: {}".format(
+                    token_id, result
+                )
+            )
+        position = convert_positions_response(token_id, bytes.fromhex(result[2:]))
+        ticks[token_id] = (position["tickLower"], position["tickUpper"])
+    return ticks
+
+
+def collect_position_transfers() -> Dict[int, List[Any]]:
+    # a single paginated scan over every transfer of the position manager,
+    # indexed by token id, instead of one request per token instance
+    transfers = event_source.token_transfers(VELO_V3_POSITION_MANAGER)
+    position_transfers = {}
+    for transfer in transfers:
+        total = transfer.get("total") or {}
+        if total.get("token_id") is None:
+            continue
+        position_transfers.setdefault(int(total["token_id"]), []).append(transfer)
+    return position_transfers
 
-    return positions
+
+async def get_pool_key(pool_contract: Contract) -> Tuple[str, str, int]:
+    return await call_functions_async(
+        [
+            pool_contract.functions.token0(),
+            pool_contract.functions.token1(),
+            pool_contract.functions.tickSpacing(),
+        ]
+    )
+
+
+def get_velodrome_v3_event_scans(
+    pool: str, gauge: str, to_block: int
+) -> List[EventScan]:
+    return [
+        ("logs", pool, VELO_V3_POOL_ABI),
+        ("token_transfers", VELO_V3_POSITION_MANAGER, None),
+    ]
 
 
 def create_velodrome_v3_service(
@@ -335,38 +553,73 @@ def create_velodrome_v3_service(
     gauge: str,
     to_block: int,
 ) -> DeFiService:
-    cache = {}
-    pool_events: List[Any] = call_blockscout_api(
-        f"https://blockscout.lisk.com/api/v2/addresses/{pool}/logs"
-    )
+    cache = _next_token_id_cache
+    pool_events: List[Any] = event_source.logs(pool, VELO_V3_POOL_ABI)
     block_numbers: List[int] = [int(event["block_number"]) for event in pool_events]
-    all_positions: Dict[int, Any] = load_all_positions(
-        w3, cache, block_numbers[0], to_block
+    store = get_shared_state(
+        "velodrome_v3_position_store", lambda: PositionStore(seed_path=_CACHE_PATH)
     )
+    with _positions_lock:
+        with profiler.stage("load_all_positions"):
+            load_all_positions(w3, store, cache, block_numbers[0], to_block)
     pool_contract = w3.eth.contract(address=pool, abi=VELO_V3_POOL_ABI)
-    pool_token0 = pool_contract.functions.token0().call().lower()
-    pool_token1 = pool_contract.functions.token1().call().lower()
-    pool_tick_spacing = pool_contract.functions.tickSpacing().call()
-    token_ids = set()
-    for token_id, position in all_positions.items():
-        if (
-            position["token0"].lower() != pool_token0
-            or position["token1"].lower() != pool_token1
-            or int(position["tickSpacing"]) != int(pool_tick_spacing)
-        ):
-            continue
-        token_ids.add(token_id)
+    pool_token0, pool_token1, pool_tick_spacing = asyncio.run(
+        get_pool_key(pool_contract)
+    )
+    token_ids = store.get_token_ids(pool_token0, pool_token1, pool_tick_spacing)
 
-    users = set()
+    users = {}
+    nft_transfers = {}
+    token_ranges = {}
+    position_transfers = get_shared_state(
+        "velodrome_v3_position_transfers", collect_position_transfers
+    )
     for token_id in token_ids:
-        transfers = call_blockscout_api(
-            f"https://blockscout.lisk.com/api/v2/tokens/{VELO_V3_POSITION_MANAGER}/instances/{token_id}/transfers"
-        )
+        transfers = position_transfers.get(token_id, [])
+        minted_at = None
+        burned_at = None
         for transfer in transfers:
-            users.add(transfer["from"]["hash"])
-            users.add(transfer["to"]["hash"])
-            block_numbers.append(int(transfer["block_number"]))
+            sender = transfer["from"]["hash"]
+            receiver = transfer["to"]["hash"]
+            block_number = int(transfer["block_number"])
+            if sender == ZERO_ADDRESS:
+                minted_at = block_number
+            elif receiver == ZERO_ADDRESS:
+                burned_at = block_number
+            elif receiver.lower() == gauge.lower():
+                users[sender] = min(users.get(sender, block_number), block_number)
+            block_numbers.append(block_number)
+            nft_transfers.setdefault(block_number, []).append(
+                (token_id, sender, receiver)
+            )
+        if minted_at is not None:
+            token_ranges[token_id] = (minted_at, burned_at)
+    # never minted within the fetched history, so never alive
+    token_ids = [token_id for token_id in token_ids if token_id in token_ranges]
+    ticks = get_position_ticks(token_ids, token_ranges)
+
+    pool_event_ticks = {}
+    for event in pool_events:
+        block_number = int(event["block_number"])
+        event_ticks = get_event_ticks(event)
+        if event_ticks is None or pool_event_ticks.get(block_number, set()) is None:
+            pool_event_ticks[block_number] = None
+        else:
+            pool_event_ticks.setdefault(block_number, set()).add(event_ticks)
 
-    users = sorted(list(users))
+    users = {user: users[user] for user in sorted(users)}
     block_numbers = sorted(list(set(block_numbers)))
-    return VelodromeV3Service(w3, vault, pool, gauge, users, token_ids, block_numbers)
+    return VelodromeV3Service(
+        w3,
+        vault,
+        pool,
+        gauge,
+        pool_token0,
+        users,
+        token_ids,
+        token_ranges,
+        ticks,
+        block_numbers,
+        nft_transfers,
+        pool_event_ticks,
+    )
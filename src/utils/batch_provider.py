@@ -0,0 +1,134 @@
+import asyncio
+import itertools
+import json
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Any, Dict, Tuple
+
+import requests
+from web3 import HTTPProvider
+from web3._utils.encoding import Web3JsonEncoder
+from web3.types import RPCEndpoint, RPCResponse
+
+from utils.profiling import profiler
+
+MAX_BATCH_SIZE = 100
+MAX_IN_FLIGHT = 8
+REQUEST_TIMEOUT = 60
+
+
+class BatchingHTTPProvider(HTTPProvider):
+    # requests are queued and sent by at most max_in_flight senders; while
+    # all of them are busy, concurrent requests pile up and go out together
+    # as one JSON-RPC batch, so an idle provider adds no latency
+    def __init__(
+        self,
+        endpoint_uri: str,
+        session: requests.Session,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_in_flight: int = MAX_IN_FLIGHT,
+        request_timeout: int = REQUEST_TIMEOUT,
+    ):
+        super().__init__(endpoint_uri, session=session)
+        self.session = session
+        self.max_batch_size = max_batch_size
+        self.max_in_flight = max_in_flight
+        self.request_timeout = request_timeout
+        self.queue: List[Tuple[Dict[str, Any], Future]] = []
+        self.in_flight = 0
+        self.lock = threading.Lock()
+        self.ids = itertools.count()
+        self.executor = ThreadPoolExecutor(max_in_flight)
+
+    def submit_many(self, rpc_requests: List[Tuple[str, Any]]) -> List[Future]:
+        # queued under one lock, so they leave together in the same batch
+        futures = []
+        for method, _ in rpc_requests:
+            profiler.count("rpc.requests")
+            profiler.count("rpc." + method)
+        with self.lock:
+            for method, params in rpc_requests:
+                request = {
+                    "jsonrpc": "2.0",
+                    "id": next(self.ids),
+                    "method": method,
+                    "params": params,
+                }
+                future = Future()
+                self.queue.append((request, future))
+                futures.append(future)
+            if futures and self.in_flight < self.max_in_flight:
+                self.in_flight += 1
+                self.executor.submit(self.drain)
+        return futures
+
+    def submit(self, method: RPCEndpoint, params: Any) -> Future:
+        return self.submit_many([(method, params)])[0]
+
+    def make_request(self, method: RPCEndpoint, params: Any) -> RPCResponse:
+        return self.submit(method, params).result()
+
+    async def request_many(
+        self, rpc_requests: List[Tuple[str, Any]]
+    ) -> List[RPCResponse]:
+        return await asyncio.gather(
+            *[asyncio.wrap_future(future) for future in self.submit_many(rpc_requests)]
+        )
+
+    def drain(self) -> None:
+        while True:
+            with self.lock:
+                batch = self.queue[: self.max_batch_size]
+                self.queue = self.queue[self.max_batch_size :]
+                if not batch:
+                    self.in_flight -= 1
+                    return
+            self.send(batch)
+
+    def send(self, batch: List[Tuple[Dict[str, Any], Future]]) -> None:
+        try:
+            data = json.dumps(
+                [request for request, _ in batch] if len(batch) > 1 else batch[0][0],
+                cls=Web3JsonEncoder,
+            )
+            started = time.perf_counter()
+            response = self.session.post(
+                self.endpoint_uri,
+                data=data,
+                headers={"Content-Type": "application/json"},
+                timeout=self.request_timeout,
+            )
+            # batches mix requests of several stages, so they are counted apart
+            profiler.count("rpc.batches", stage="rpc")
+            profiler.count("rpc.request_bytes", len(data), stage="rpc")
+            profiler.count("rpc.response_bytes", len(response.content), stage="rpc")
+            profiler.count(
+                "rpc.milliseconds",
+                int((time.perf_counter() - started) * 1000),
+                stage="rpc",
+            )
+            response.raise_for_status()
+            items = response.json()
+            if not isinstance(items, list):
+                items = [items]
+            responses: Dict[Any, Any] = {item.get("id"): item for item in items}
+            for request, future in batch:
+                item = responses.get(request["id"])
+                if item is None and len(items) == 1 and "error" in items[0]:
+                    # the node rejected the batch as a whole
+                    item = {**items[0], "id": request["id"]}
+                if item is None:
+                    future.set_exception(
+                        Exception(
+                            "BatchingHTTPProvider: no response for {}".format(
+                                request["method"]
+                            )
+                        )
+                    )
+                else:
+                    future.set_result(item)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
@@ -0,0 +1,133 @@
+import asyncio
+import atexit
+import json
+import threading
+import aiohttp
+from typing import List, Any, Awaitable, Dict, AsyncIterator, Optional, TypeVar
+
+from utils.profiling import profiler
+
+MAX_CONNECTIONS = 8
+MAX_RETRIES = 8
+INITIAL_BACKOFF = 0.5
+MAX_BACKOFF = 30.0
+REQUEST_TIMEOUT = 60
+
+T = TypeVar("T")
+
+
+def format_params(params: Dict[str, Any]) -> Dict[str, str]:
+    return {
+        key: "null" if value is None else str(value) for key, value in params.items()
+    }
+
+
+class BlockscoutClient:
+    def __init__(
+        self,
+        max_connections: int = MAX_CONNECTIONS,
+        max_retries: int = MAX_RETRIES,
+    ):
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.semaphore: Optional[asyncio.Semaphore] = None
+
+    async def __aenter__(self) -> "BlockscoutClient":
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=self.max_connections, keepalive_timeout=60
+            ),
+            timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
+            headers={"accept": "application/json"},
+        )
+        self.semaphore = asyncio.Semaphore(self.max_connections)
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.session.close()
+
+    async def get(self, url: str, params: Dict[str, Any] = {}) -> Any:
+        backoff = INITIAL_BACKOFF
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self.semaphore:
+                    async with self.session.get(
+                        url, params=format_params(params)
+                    ) as response:
+                        response.raise_for_status()
+                        body = await response.read()
+                profiler.count("blockscout.requests")
+                profiler.count("blockscout.response_bytes", len(body))
+                return json.loads(body)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise Exception(
+                        "BlockscoutClient: request failed after {} retries: {} {}".format(
+                            self.max_retries, url, params
+                        )
+                    ) from e
+                print(e)
+                print(url, params)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+
+    async def iterate_pages(
+        self, url: str, params: Dict[str, Any] = {}
+    ) -> AsyncIterator[List[Any]]:
+        # blockscout pages are cursor based and come newest-first
+        pagination = {}
+        while True:
+            response = await self.get(url, {**params, **pagination})
+            yield response["items"]
+            pagination = response["next_page_params"]
+            if not pagination:
+                break
+
+    async def fetch_all(self, url: str, params: Dict[str, Any] = {}) -> List[Any]:
+        full_response = []
+        async for items in self.iterate_pages(url, params):
+            full_response.extend(items)
+        return full_response[::-1]
+
+    async def fetch_since(
+        self, url: str, from_block: int, params: Dict[str, Any] = {}
+    ) -> List[Any]:
+        full_response = []
+        async for items in self.iterate_pages(url, params):
+            full_response.extend(
+                [item for item in items if int(item["block_number"]) >= from_block]
+            )
+            if items and int(items[-1]["block_number"]) < from_block:
+                break
+        return full_response[::-1]
+
+
+class BlockscoutRunner:
+    # an event loop thread owning one long-lived client, so every thread of
+    # the process shares its keep-alive connections and request bound
+    def __init__(self, client: BlockscoutClient):
+        self.client = client
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        self.run(self.client.__aenter__())
+
+    def run(self, coroutine: Awaitable[T]) -> T:
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def close(self) -> None:
+        self.run(self.client.__aexit__())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+_blockscout_runner: Optional[BlockscoutRunner] = None
+_blockscout_runner_lock = threading.Lock()
+
+
+def get_blockscout_runner() -> BlockscoutRunner:
+    global _blockscout_runner
+    with _blockscout_runner_lock:
+        if _blockscout_runner is None:
+            _blockscout_runner = BlockscoutRunner(BlockscoutClient())
+            atexit.register(_blockscout_runner.close)
+    return _blockscout_runner
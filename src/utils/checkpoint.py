@@ -0,0 +1,38 @@
+import os
+import pickle
+from typing import Any, Dict, Optional
+
+CHECKPOINT_PATH = os.getenv("CHECKPOINT_PATH", "./cache/checkpoints")
+# blocks between two checkpoints
+CHECKPOINT_INTERVAL = int(os.getenv("CHECKPOINT_INTERVAL", "50000"))
+# continue interrupted runs from their last checkpoint
+CHECKPOINT_RESUME = os.getenv("CHECKPOINT_RESUME", "0") == "1"
+
+
+def get_checkpoint_file(vault: str, from_block: int, to_block: int) -> str:
+    return os.path.join(
+        CHECKPOINT_PATH, "{}_{}_{}.pickle".format(vault, from_block, to_block)
+    )
+
+
+def save_checkpoint(file_name: str, state: Dict[str, Any]) -> None:
+    # written next to the previous one and swapped in, so a crash while
+    # saving never leaves a truncated checkpoint behind
+    directory = os.path.dirname(file_name)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(file_name + ".tmp", "wb") as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(file_name + ".tmp", file_name)
+
+
+def load_checkpoint(file_name: str) -> Optional[Dict[str, Any]]:
+    if not os.path.exists(file_name):
+        return None
+    with open(file_name, "rb") as f:
+        return pickle.load(f)
+
+
+def remove_checkpoint(file_name: str) -> None:
+    if os.path.exists(file_name):
+        os.remove(file_name)
@@ -0,0 +1,171 @@
+import mmap
+import os
+import struct
+from array import array
+from typing import List, Any, Dict, Iterable, Iterator, Tuple
+
+from eth_utils import to_checksum_address
+
+# distributions: header | addresses (n * 20) | amounts (n * 32)
+DISTRIBUTION_MAGIC = b"MDST"
+DISTRIBUTION_HEADER = struct.Struct("<4sHHQ")
+
+# proofs: header | addresses (n * 20) | amounts (n * 32)
+#         | proof nodes (m * 32) | proof offsets ((n + 1) * 4)
+PROOFS_MAGIC = b"MPRF"
+PROOFS_HEADER = struct.Struct("<4sHHQQ32s20s")
+
+FORMAT_VERSION = 1
+
+
+def address_to_bytes(address: str) -> bytes:
+    value = bytes.fromhex(address[2:])
+    if len(value) != 20:
+        raise ValueError("Invalid address: {}".format(address))
+    return value
+
+
+def get_distribution_path(label: str, vault: str) -> str:
+    # <epoch>/columnar/<label name>/<vault>.bin next to the csv directory
+    # <epoch>/<label name>, which is expected to only hold csv files
+    label = os.path.normpath(label)
+    return os.path.join(
+        os.path.dirname(label), "columnar", os.path.basename(label), vault + ".bin"
+    )
+
+
+def write_distribution(file_name: str, rows: List[Tuple[str, int]]) -> None:
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+    with open(file_name, "wb") as f:
+        f.write(
+            DISTRIBUTION_HEADER.pack(DISTRIBUTION_MAGIC, FORMAT_VERSION, 0, len(rows))
+        )
+        for user, _ in rows:
+            f.write(address_to_bytes(user))
+        for _, amount in rows:
+            f.write(int(amount).to_bytes(32, "big"))
+
+
+def write_proofs(
+    file_name: str,
+    root: bytes,
+    reward_token: str,
+    users: List[str],
+    balances: List[int],
+    proofs: Iterable[List[bytes]],
+) -> None:
+    # proofs are consumed lazily; the header is rewritten at the end once
+    # the total number of proof nodes is known
+    n = len(users)
+    offsets = array("I", [0])
+    with open(file_name, "wb") as f:
+        f.write(bytes(PROOFS_HEADER.size))
+        for user in users:
+            f.write(address_to_bytes(user))
+        for balance in balances:
+            f.write(int(balance).to_bytes(32, "big"))
+        for proof in proofs:
+            f.write(b"".join(proof))
+            offsets.append(offsets[-1] + len(proof))
+        if len(offsets) != n + 1:
+            raise Exception(
+                "Columnar: {} proofs for {} users".format(len(offsets) - 1, n)
+            )
+        f.write(struct.pack("<{}I".format(n + 1), *offsets))
+        f.seek(0)
+        f.write(
+            PROOFS_HEADER.pack(
+                PROOFS_MAGIC,
+                FORMAT_VERSION,
+                0,
+                n,
+                offsets[-1],
+                root,
+                address_to_bytes(reward_token),
+            )
+        )
+
+
+class DistributionFile:
+    def __init__(self, file_name: str):
+        with open(file_name, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, self.n = DISTRIBUTION_HEADER.unpack_from(self.buffer, 0)
+        if magic != DISTRIBUTION_MAGIC or version != FORMAT_VERSION:
+            raise Exception("Columnar: {} is not a distribution file".format(file_name))
+        self.addresses_offset = DISTRIBUTION_HEADER.size
+        self.amounts_offset = self.addresses_offset + 20 * self.n
+
+    def __len__(self) -> int:
+        return self.n
+
+    def address(self, i: int) -> str:
+        offset = self.addresses_offset + 20 * i
+        return to_checksum_address(self.buffer[offset : offset + 20])
+
+    def amount(self, i: int) -> int:
+        offset = self.amounts_offset + 32 * i
+        return int.from_bytes(self.buffer[offset : offset + 32], "big")
+
+    def items(self) -> Iterator[Tuple[str, int]]:
+        for i in range(self.n):
+            yield self.address(i), self.amount(i)
+
+    def close(self) -> None:
+        self.buffer.close()
+
+
+class ProofsFile:
+    def __init__(self, file_name: str):
+        with open(file_name, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (
+            magic,
+            version,
+            _,
+            self.n,
+            self.total_nodes,
+            self.root,
+            reward_token,
+        ) = PROOFS_HEADER.unpack_from(self.buffer, 0)
+        if magic != PROOFS_MAGIC or version != FORMAT_VERSION:
+            raise Exception("Columnar: {} is not a proofs file".format(file_name))
+        self.reward_token = to_checksum_address(reward_token)
+        self.addresses_offset = PROOFS_HEADER.size
+        self.amounts_offset = self.addresses_offset + 20 * self.n
+        self.nodes_offset = self.amounts_offset + 32 * self.n
+        self.proof_offsets_offset = self.nodes_offset + 32 * self.total_nodes
+
+    def __len__(self) -> int:
+        return self.n
+
+    def address_bytes(self, i: int) -> bytes:
+        offset = self.addresses_offset + 20 * i
+        return self.buffer[offset : offset + 20]
+
+    def address(self, i: int) -> str:
+        return to_checksum_address(self.address_bytes(i))
+
+    def amount(self, i: int) -> int:
+        offset = self.amounts_offset + 32 * i
+        return int.from_bytes(self.buffer[offset : offset + 32], "big")
+
+    def proof(self, i: int) -> List[bytes]:
+        start, end = struct.unpack_from(
+            "<II", self.buffer, self.proof_offsets_offset + 4 * i
+        )
+        return [
+            self.buffer[self.nodes_offset + 32 * j : self.nodes_offset + 32 * (j + 1)]
+            for j in range(start, end)
+        ]
+
+    def entry(self, i: int) -> Dict[str, Any]:
+        return {
+            "address": self.address(i),
+            "reward": self.reward_token,
+            "amount": str(self.amount(i)),
+            "proof": ["0x" + node.hex() for node in self.proof(i)],
+        }
+
+    def close(self) -> None:
+        self.buffer.close()
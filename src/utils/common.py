@@ -1,14 +1,23 @@
 from web3 import Web3
 from web3.eth import Contract
-from typing import List, Any, Dict, Set, Tuple
+from web3.contract.contract import ContractFunction
+from typing import List, Any, Callable, Dict, Optional, Set, Tuple
 import requests
+from requests.adapters import HTTPAdapter
 import csv
 from eth_abi.abi import decode
 import os
-from random import randint
-import time
 from dotenv import load_dotenv
 import json
+import threading
+import asyncio
+
+from utils.multicall import MulticallExecutor
+from utils.batch_provider import BatchingHTTPProvider
+from utils.rpc_cache import rpc_cache_middleware, get_cached_results, put_response
+from utils.event_source import create_event_source, EventScan
+from utils.verification import Verifier
+from utils.profiling import profiler
 
 MULTICALL_ABI = [
     {
@@ -104,6 +113,191 @@ VELO_V3_POOL_ABI = [
         "stateMutability": "view",
         "type": "function",
     },
+    # events, used to decode raw logs
+    {
+        "anonymous": False,
+        "inputs": [
+            {
+                "indexed": False,
+                "internalType": "address",
+                "name": "sender",
+                "type": "address",
+            },
+            {
+                "indexed": True,
+                "internalType": "address",
+                "name": "owner",
+                "type": "address",
+            },
+            {
+                "indexed": True,
+                "internalType": "int24",
+                "name": "tickLower",
+                "type": "int24",
+            },
+            {
+                "indexed": True,
+                "internalType": "int24",
+                "name": "tickUpper",
+                "type": "int24",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint128",
+                "name": "amount",
+                "type": "uint128",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "amount0",
+                "type": "uint256",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "amount1",
+                "type": "uint256",
+            },
+        ],
+        "name": "Mint",
+        "type": "event",
+    },
+    {
+        "anonymous": False,
+        "inputs": [
+            {
+                "indexed": True,
+                "internalType": "address",
+                "name": "owner",
+                "type": "address",
+            },
+            {
+                "indexed": True,
+                "internalType": "int24",
+                "name": "tickLower",
+                "type": "int24",
+            },
+            {
+                "indexed": True,
+                "internalType": "int24",
+                "name": "tickUpper",
+                "type": "int24",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint128",
+                "name": "amount",
+                "type": "uint128",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "amount0",
+                "type": "uint256",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "amount1",
+                "type": "uint256",
+            },
+        ],
+        "name": "Burn",
+        "type": "event",
+    },
+    {
+        "anonymous": False,
+        "inputs": [
+            {
+                "indexed": True,
+                "internalType": "address",
+                "name": "owner",
+                "type": "address",
+            },
+            {
+                "indexed": False,
+                "internalType": "address",
+                "name": "recipient",
+                "type": "address",
+            },
+            {
+                "indexed": True,
+                "internalType": "int24",
+                "name": "tickLower",
+                "type": "int24",
+            },
+            {
+                "indexed": True,
+                "internalType": "int24",
+                "name": "tickUpper",
+                "type": "int24",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint128",
+                "name": "amount0",
+                "type": "uint128",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint128",
+                "name": "amount1",
+                "type": "uint128",
+            },
+        ],
+        "name": "Collect",
+        "type": "event",
+    },
+    {
+        "anonymous": False,
+        "inputs": [
+            {
+                "indexed": True,
+                "internalType": "address",
+                "name": "sender",
+                "type": "address",
+            },
+            {
+                "indexed": True,
+                "internalType": "address",
+                "name": "recipient",
+                "type": "address",
+            },
+            {
+                "indexed": False,
+                "internalType": "int256",
+                "name": "amount0",
+                "type": "int256",
+            },
+            {
+                "indexed": False,
+                "internalType": "int256",
+                "name": "amount1",
+                "type": "int256",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint160",
+                "name": "sqrtPriceX96",
+                "type": "uint160",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint128",
+                "name": "liquidity",
+                "type": "uint128",
+            },
+            {
+                "indexed": False,
+                "internalType": "int24",
+                "name": "tick",
+                "type": "int24",
+            },
+        ],
+        "name": "Swap",
+        "type": "event",
+    },
 ]
 VELO_V2_POOL_ABI = [
     {
@@ -128,6 +322,508 @@ VELO_V2_POOL_ABI = [
         "stateMutability": "view",
         "type": "function",
     },
+    # events, used to decode raw logs
+    {
+        "anonymous": False,
+        "inputs": [
+            {
+                "indexed": True,
+                "internalType": "address",
+                "name": "from",
+                "type": "address",
+            },
+            {
+                "indexed": True,
+                "internalType": "address",
+                "name": "to",
+                "type": "address",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "value",
+                "type": "uint256",
+            },
+        ],
+        "name": "Transfer",
+        "type": "event",
+    },
+    {
+        "anonymous": False,
+        "inputs": [
+            {
+                "indexed": True,
+                "internalType": "address",
+                "name": "sender",
+                "type": "address",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "amount0",
+                "type": "uint256",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "amount1",
+                "type": "uint256",
+            },
+        ],
+        "name": "Mint",
+        "type": "event",
+    },
+    {
+        "anonymous": False,
+        "inputs": [
+            {
+                "indexed": True,
+                "internalType": "address",
+                "name": "sender",
+                "type": "address",
+            },
+            {
+                "indexed": True,
+                "internalType": "address",
+                "name": "to",
+                "type": "address",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "amount0",
+                "type": "uint256",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "amount1",
+                "type": "uint256",
+            },
+        ],
+        "name": "Burn",
+        "type": "event",
+    },
+    {
+        "anonymous": False,
+        "inputs": [
+            {
+                "indexed": True,
+                "internalType": "address",
+                "name": "sender",
+                "type": "address",
+            },
+            {
+                "indexed": True,
+                "internalType": "address",
+                "name": "to",
+                "type": "address",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "amount0In",
+                "type": "uint256",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "amount1In",
+                "type": "uint256",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "amount0Out",
+                "type": "uint256",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "amount1Out",
+                "type": "uint256",
+            },
+        ],
+        "name": "Swap",
+        "type": "event",
+    },
+    {
+        "anonymous": False,
+        "inputs": [
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "reserve0",
+                "type": "uint256",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "reserve1",
+                "type": "uint256",
+            },
+        ],
+        "name": "Sync",
+        "type": "event",
+    },
+    {
+        "anonymous": False,
+        "inputs": [
+            {
+                "indexed": True,
+                "internalType": "address",
+                "name": "sender",
+                "type": "address",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "amount0",
+                "type": "uint256",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "amount1",
+                "type": "uint256",
+            },
+        ],
+        "name": "Fees",
+        "type": "event",
+    },
+    {
+        "anonymous": False,
+        "inputs": [
+            {
+                "indexed": True,
+                "internalType": "address",
+                "name": "sender",
+                "type": "address",
+            },
+            {
+                "indexed": True,
+                "internalType": "address",
+                "name": "recipient",
+                "type": "address",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "amount0",
+                "type": "uint256",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "amount1",
+                "type": "uint256",
+            },
+        ],
+        "name": "Claim",
+        "type": "event",
+    },
+]
+MORPHO_ABI = [
+    # events, used to decode raw logs
+    {
+        "anonymous": False,
+        "inputs": [
+            {"indexed": True, "internalType": "Id", "name": "id", "type": "bytes32"},
+            {
+                "indexed": False,
+                "internalType": "struct MarketParams",
+                "name": "marketParams",
+                "type": "tuple",
+                "components": [
+                    {"internalType": "address", "name": "loanToken", "type": "address"},
+                    {
+                        "internalType": "address",
+                        "name": "collateralToken",
+                        "type": "address",
+                    },
+                    {"internalType": "address", "name": "oracle", "type": "address"},
+                    {"internalType": "address", "name": "irm", "type": "address"},
+                    {"internalType": "uint256", "name": "lltv", "type": "uint256"},
+                ],
+            },
+        ],
+        "name": "CreateMarket",
+        "type": "event",
+    },
+    {
+        "anonymous": False,
+        "inputs": [
+            {"indexed": True, "internalType": "Id", "name": "id", "type": "bytes32"},
+            {
+                "indexed": True,
+                "internalType": "address",
+                "name": "caller",
+                "type": "address",
+            },
+            {
+                "indexed": True,
+                "internalType": "address",
+                "name": "onBehalf",
+                "type": "address",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "assets",
+                "type": "uint256",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "shares",
+                "type": "uint256",
+            },
+        ],
+        "name": "Supply",
+        "type": "event",
+    },
+    {
+        "anonymous": False,
+        "inputs": [
+            {"indexed": True, "internalType": "Id", "name": "id", "type": "bytes32"},
+            {
+                "indexed": False,
+                "internalType": "address",
+                "name": "caller",
+                "type": "address",
+            },
+            {
+                "indexed": True,
+                "internalType": "address",
+                "name": "onBehalf",
+                "type": "address",
+            },
+            {
+                "indexed": True,
+                "internalType": "address",
+                "name": "receiver",
+                "type": "address",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "assets",
+                "type": "uint256",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "shares",
+                "type": "uint256",
+            },
+        ],
+        "name": "Withdraw",
+        "type": "event",
+    },
+    {
+        "anonymous": False,
+        "inputs": [
+            {"indexed": True, "internalType": "Id", "name": "id", "type": "bytes32"},
+            {
+                "indexed": False,
+                "internalType": "address",
+                "name": "caller",
+                "type": "address",
+            },
+            {
+                "indexed": True,
+                "internalType": "address",
+                "name": "onBehalf",
+                "type": "address",
+            },
+            {
+                "indexed": True,
+                "internalType": "address",
+                "name": "receiver",
+                "type": "address",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "assets",
+                "type": "uint256",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "shares",
+                "type": "uint256",
+            },
+        ],
+        "name": "Borrow",
+        "type": "event",
+    },
+    {
+        "anonymous": False,
+        "inputs": [
+            {"indexed": True, "internalType": "Id", "name": "id", "type": "bytes32"},
+            {
+                "indexed": True,
+                "internalType": "address",
+                "name": "caller",
+                "type": "address",
+            },
+            {
+                "indexed": True,
+                "internalType": "address",
+                "name": "onBehalf",
+                "type": "address",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "assets",
+                "type": "uint256",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "shares",
+                "type": "uint256",
+            },
+        ],
+        "name": "Repay",
+        "type": "event",
+    },
+    {
+        "anonymous": False,
+        "inputs": [
+            {"indexed": True, "internalType": "Id", "name": "id", "type": "bytes32"},
+            {
+                "indexed": True,
+                "internalType": "address",
+                "name": "caller",
+                "type": "address",
+            },
+            {
+                "indexed": True,
+                "internalType": "address",
+                "name": "onBehalf",
+                "type": "address",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "assets",
+                "type": "uint256",
+            },
+        ],
+        "name": "SupplyCollateral",
+        "type": "event",
+    },
+    {
+        "anonymous": False,
+        "inputs": [
+            {"indexed": True, "internalType": "Id", "name": "id", "type": "bytes32"},
+            {
+                "indexed": False,
+                "internalType": "address",
+                "name": "caller",
+                "type": "address",
+            },
+            {
+                "indexed": True,
+                "internalType": "address",
+                "name": "onBehalf",
+                "type": "address",
+            },
+            {
+                "indexed": True,
+                "internalType": "address",
+                "name": "receiver",
+                "type": "address",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "assets",
+                "type": "uint256",
+            },
+        ],
+        "name": "WithdrawCollateral",
+        "type": "event",
+    },
+    {
+        "anonymous": False,
+        "inputs": [
+            {"indexed": True, "internalType": "Id", "name": "id", "type": "bytes32"},
+            {
+                "indexed": True,
+                "internalType": "address",
+                "name": "caller",
+                "type": "address",
+            },
+            {
+                "indexed": True,
+                "internalType": "address",
+                "name": "borrower",
+                "type": "address",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "repaidAssets",
+                "type": "uint256",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "repaidShares",
+                "type": "uint256",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "seizedAssets",
+                "type": "uint256",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "badDebtAssets",
+                "type": "uint256",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "badDebtShares",
+                "type": "uint256",
+            },
+        ],
+        "name": "Liquidate",
+        "type": "event",
+    },
+    {
+        "anonymous": False,
+        "inputs": [
+            {"indexed": True, "internalType": "Id", "name": "id", "type": "bytes32"},
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "prevBorrowRate",
+                "type": "uint256",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "interest",
+                "type": "uint256",
+            },
+            {
+                "indexed": False,
+                "internalType": "uint256",
+                "name": "feeShares",
+                "type": "uint256",
+            },
+        ],
+        "name": "AccrueInterest",
+        "type": "event",
+    },
 ]
 
 load_dotenv()
@@ -136,11 +832,116 @@ MULTICALL_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
 VELO_V3_POSITION_MANAGER = "0x991d5546C4B442B4c5fdc4c8B8b8d131DEB24702"
 SUGAR_ADDRESS = "0xB98fB4C9C99dE155cCbF5A14af0dBBAd96033D6f"
 ZERO_ADDRESS = "0x" + "".zfill(40)
+BLOCKSCOUT_API_URL = os.getenv(
+    "BLOCKSCOUT_API_URL", "https://blockscout.lisk.com/api/v2"
+)
+# blockscout or rpc (eth_getLogs)
+EVENT_SOURCE = os.getenv("EVENT_SOURCE", "blockscout")
+EVENT_SOURCE_FROM_BLOCK = int(os.getenv("EVENT_SOURCE_FROM_BLOCK", "0"))
+
+RPC_POOL_SIZE = 32
+RPC_BATCH_SIZE = 100
+RPC_TIMEOUT = 60
+
+rpc_session = requests.Session()
+rpc_session.mount("http://", HTTPAdapter(pool_maxsize=RPC_POOL_SIZE))
+rpc_session.mount("https://", HTTPAdapter(pool_maxsize=RPC_POOL_SIZE))
+rpc_provider = BatchingHTTPProvider(
+    RPC_URL, rpc_session, max_batch_size=RPC_BATCH_SIZE, request_timeout=RPC_TIMEOUT
+)
+w3 = Web3(rpc_provider)
+w3.middleware_onion.add(rpc_cache_middleware, "rpc_cache")
+multicall_executor = MulticallExecutor(
+    w3.eth.contract(Web3.to_checksum_address(MULTICALL_ADDRESS), abi=MULTICALL_ABI)
+)
+event_source = create_event_source(
+    EVENT_SOURCE, w3, BLOCKSCOUT_API_URL, EVENT_SOURCE_FROM_BLOCK
+)
 
-w3 = Web3(Web3.HTTPProvider(RPC_URL))
+
+def call_rpc_batch(rpc_requests: List[Tuple[str, List[Any]]]) -> List[Tuple[bool, Any]]:
+    # answers what it can from the rpc cache and hands the rest to the
+    # batching provider at once; returns (success, result or error) in
+    # request order
+    keys, results, missing = get_cached_results(rpc_requests)
+    futures = dict(
+        zip(missing, rpc_provider.submit_many([rpc_requests[i] for i in missing]))
+    )
+    responses = []
+    for index, result in enumerate(results):
+        if index not in futures:
+            responses.append((True, result))
+            continue
+        response = futures[index].result()
+        if "error" in response:
+            responses.append((False, response["error"]))
+            continue
+        responses.append((True, response["result"]))
+        put_response(keys[index], response)
+    return responses
+
+
+async def call_functions_async(
+    functions: List[ContractFunction], block_identifier: Any = "latest"
+) -> List[Any]:
+    # eth_calls of contract functions, sent as one batch
+    if isinstance(block_identifier, int):
+        block_identifier = hex(block_identifier)
+    rpc_requests = [
+        (
+            "eth_call",
+            [
+                {"to": function.address, "data": function._encode_transaction_data()},
+                block_identifier,
+            ],
+        )
+        for function in functions
+    ]
+    keys, results, missing = get_cached_results(rpc_requests)
+    responses = await rpc_provider.request_many([rpc_requests[i] for i in missing])
+    for index, response in zip(missing, responses):
+        if "error" in response:
+            raise Exception(
+                "RPC: call to {} failed: {}".format(
+                    functions[index].fn_name, response["error"]
+                )
+            )
+        results[index] = response["result"]
+        put_response(keys[index], response)
+    values = []
+    for function, result in zip(functions, results):
+        decoded = decode(
+            [item["type"] for item in function.abi["outputs"]],
+            bytes.fromhex(result[2:]),
+        )
+        values.append(decoded[0] if len(decoded) == 1 else list(decoded))
+    return values
+
+
+_shared_state: Dict[Any, List[Any]] = {}
+_shared_state_lock = threading.Lock()
+
+
+def get_shared_state(key: Any, factory: Callable[[], Any]) -> Any:
+    # computes the value once per process, even if several vaults that point
+    # to the same protocol contract ask for it concurrently
+    with _shared_state_lock:
+        if key not in _shared_state:
+            _shared_state[key] = [threading.Lock(), None, False]
+        entry = _shared_state[key]
+    with entry[0]:
+        if not entry[2]:
+            entry[1] = factory()
+            entry[2] = True
+    return entry[1]
 
 
 class DeFiService:
+    # set by the engine; without one, checks run inline and raise
+    verifier: Optional[Verifier] = None
+    # attributes that change while processing blocks, saved in checkpoints
+    state_attributes = ["iterator", "cached_distributions", "cached_block_number"]
+
     def __init__(self):
         pass
 
@@ -166,52 +967,96 @@ class DeFiService:
 
         return (pool, distributions)
 
+    def verify(self, block_number: int, check: Callable[[], List[str]]) -> None:
+        if self.verifier is None:
+            messages = check()
+            if messages:
+                raise Exception("{}: {}".format(self.name(), messages[0]))
+            return
+        self.verifier.submit("{} at block {}".format(self.name(), block_number), check)
+
+    def get_state(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.state_attributes}
+
+    def set_state(self, state: Dict[str, Any]) -> None:
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # services are sent to shard processes without their node handles,
+        # which are attached again from the globals of the receiving process
+        state = dict(self.__dict__)
+        for name in ["w3", "pool_contract", "multicall", "verifier"]:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self.connect()
+
+    def connect(self) -> None:
+        self.w3 = w3
+
+    def consume_block_numbers(self, block_number: int) -> List[int]:
+        # advances past the change blocks up to block_number and returns them
+        consumed_block_numbers = []
+        while (
+            self.iterator < len(self.block_numbers)
+            and self.block_numbers[self.iterator] <= block_number
+        ):
+            consumed_block_numbers.append(self.block_numbers[self.iterator])
+            self.iterator += 1
+        return consumed_block_numbers
+
+    def fetch_snapshot(
+        self,
+        block_number: int,
+        consumed_block_numbers: List[int],
+        previous_block_number: Optional[int],
+    ) -> Any:
+        # only reads, without touching the service state, so snapshots of
+        # later blocks can be fetched ahead in worker threads
+        pass
+
+    def apply_snapshot(
+        self,
+        block_number: int,
+        consumed_block_numbers: List[int],
+        snapshot: Any,
+    ) -> Tuple[str, List[Tuple[str, int]]]:
+        pass
+
     def calculate_distributions(
         self, block_number: int
     ) -> Tuple[str, List[Tuple[str, int]]]:
         pass
 
+    def timed_fetch_snapshot(
+        self,
+        block_number: int,
+        consumed_block_numbers: List[int],
+        previous_block_number: Optional[int],
+    ) -> Any:
+        # fetches run in prefetch worker threads and applies in the loop
+        # thread, so they are reported as separate stages
+        with profiler.stage(self.name() + ".fetch"):
+            return self.fetch_snapshot(
+                block_number, consumed_block_numbers, previous_block_number
+            )
 
-def call_blockscout_api(
-    url: str, params: Dict[str, Any] = {}, limit_function={}, is_multiple=True
-) -> List[Any]:
-    pagination = {}
-    full_response = []
-    while True:
-        full_url = url
-        separator = "?"
-        for key, value in list(params.items()) + list(pagination.items()):
-            full_url += separator + key + "=" + str("null" if value is None else value)
-            separator = "&"
-        response = None
-        while True:
-            try:
-                response = requests.get(
-                    full_url, headers={"accept": "application/json"}
-                ).json()
-                if not is_multiple:
-                    return response
-                if limit_function and limit_function(response["items"]):
-                    return full_response
-                full_response.extend(response["items"])
-                pagination = response["next_page_params"]
-                break
-            except Exception as e:
-                print(e)
-                print(full_url, response)
-                time.sleep(1)
-        if not pagination:
-            break
-
-    return full_response[::-1]
+    def timed_apply_snapshot(
+        self,
+        block_number: int,
+        consumed_block_numbers: List[int],
+        snapshot: Any,
+    ) -> Tuple[str, List[Tuple[str, int]]]:
+        with profiler.stage(self.name() + ".apply"):
+            return self.apply_snapshot(block_number, consumed_block_numbers, snapshot)
 
 
 def get_token_balances_onchain(
     token: str, holders: List[str], block_number: int
 ) -> Tuple[List[int], int]:
-    multi_call = w3.eth.contract(
-        Web3.to_checksum_address(MULTICALL_ADDRESS), abi=MULTICALL_ABI
-    )
     calls = [
         [
             token,
@@ -220,8 +1065,6 @@ def get_token_balances_onchain(
         for holder in holders
     ]
     calls.append([token, "0x18160ddd"])
-    responses = multi_call.functions.aggregate(calls).call(
-        block_identifier=block_number
-    )
-    balances = [int(response.hex(), 16) for response in responses[1]]
+    responses = multicall_executor.aggregate(calls, block_number)
+    balances = [int(response.hex(), 16) for response in responses]
     return balances[:-1], balances[-1]
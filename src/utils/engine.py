@@ -0,0 +1,362 @@
+from utils.common import *
+from utils.prefetch import SnapshotPrefetcher, PREFETCH_LOOKAHEAD
+from utils.verification import Verifier
+from utils.holder_balances import HolderBalances
+from utils.profiling import profiler
+from utils.checkpoint import (
+    CHECKPOINT_INTERVAL,
+    save_checkpoint,
+    load_checkpoint,
+    remove_checkpoint,
+)
+
+CHECKS_INTERVAL = 5000
+# processes the change points are split across, 1 runs in-process; only
+# single process runs write checkpoints and can resume
+SHARDS = int(os.getenv("SHARDS", "1"))
+
+
+def is_checkpoint(block_number: int, from_block: int, to_block: int) -> bool:
+    return (
+        block_number - from_block
+    ) % CHECKS_INTERVAL == 0 or block_number == to_block
+
+
+def get_change_points(
+    transfers: List[Dict[str, Any]],
+    services: List[DeFiService],
+    from_block: int,
+    to_block: int,
+) -> List[int]:
+    # blocks at which either holder balances, service distributions or
+    # checks can change; everything in between is constant
+    points = set(range(from_block, to_block + 1, CHECKS_INTERVAL))
+    points.add(to_block)
+    for transfer in transfers:
+        if from_block < transfer["block_number"] <= to_block:
+            points.add(transfer["block_number"])
+    for service in services:
+        for block_number in service.block_numbers:
+            if from_block < block_number <= to_block:
+                points.add(block_number)
+    return sorted(points)
+
+
+def get_balance_discrepancies(
+    vault: str, user_balances: Dict[str, int], block_number: int
+) -> List[str]:
+    onchain_balances, total_supply = get_token_balances_onchain(
+        vault, list(user_balances.keys()), block_number
+    )
+    discrepancies = []
+    if sum(onchain_balances) != total_supply:
+        discrepancies.append(
+            "total supply {} != sum(onchain balances) {}".format(
+                total_supply, sum(onchain_balances)
+            )
+        )
+    for index, (user, balance) in enumerate(user_balances.items()):
+        if onchain_balances[index] != balance:
+            discrepancies.append(
+                "balance of {} is {}, onchain {}".format(
+                    user, balance, onchain_balances[index]
+                )
+            )
+    return discrepancies
+
+
+def accumulate_balances(
+    vault: str,
+    transfers: List[Dict[str, Any]],
+    services: List[DeFiService],
+    from_block: int,
+    to_block: int,
+    write_logs: bool = False,
+    lookahead: int = PREFETCH_LOOKAHEAD,
+    verifier: Optional[Verifier] = None,
+    checkpoint_file: Optional[str] = None,
+    resume: bool = False,
+) -> Dict[str, int]:
+    points = get_change_points(transfers, services, from_block, to_block)
+    verifier = verifier or Verifier()
+    for service in services:
+        service.verifier = verifier
+
+    checkpoint = None
+    if resume and checkpoint_file is not None:
+        checkpoint = load_checkpoint(checkpoint_file)
+    start = 0
+    if checkpoint is not None:
+        if (
+            checkpoint["points"] != len(points)
+            or points[checkpoint["index"]] != checkpoint["block_number"]
+            or len(checkpoint["services"]) != len(services)
+        ):
+            raise Exception(
+                "Checkpoint: {} does not match this run".format(checkpoint_file)
+            )
+        for service, state in zip(services, checkpoint["services"]):
+            service.set_state(state)
+        with verifier.lock:
+            verifier.discrepancies.extend(checkpoint["discrepancies"])
+        start = checkpoint["index"] + 1
+        print("Resuming after block {}...".format(checkpoint["block_number"]))
+
+    cumulative_balances = run_points(
+        vault,
+        transfers,
+        services,
+        points,
+        from_block,
+        to_block,
+        write_logs,
+        lookahead,
+        verifier,
+        start,
+        len(points),
+        checkpoint,
+        checkpoint_file,
+    )
+    if checkpoint_file is not None:
+        remove_checkpoint(checkpoint_file)
+    return cumulative_balances
+
+
+def get_shard_bounds(points: List[int], shards: int) -> List[Tuple[int, int]]:
+    # contiguous ranges [start, stop) of change point indexes
+    starts = sorted(set(len(points) * shard // shards for shard in range(shards)))
+    return list(zip(starts, starts[1:] + [len(points)]))
+
+
+def seed_services(services: List[DeFiService], points: List[int], start: int) -> None:
+    # brings the services to the state a single run has at points[start]:
+    # a full snapshot at the last point where their distributions changed,
+    # max(from_block, last change block <= points[start])
+    if start == 0:
+        return
+    for service in services:
+        consumed_block_numbers = service.consume_block_numbers(points[start])
+        if not consumed_block_numbers:
+            continue
+        block_number = max(points[0], consumed_block_numbers[-1])
+        snapshot = service.timed_fetch_snapshot(
+            block_number, consumed_block_numbers, None
+        )
+        service.timed_apply_snapshot(block_number, consumed_block_numbers, snapshot)
+
+
+def accumulate_shard(
+    vault: str,
+    transfers: List[Dict[str, Any]],
+    services: List[DeFiService],
+    from_block: int,
+    to_block: int,
+    start: int,
+    stop: int,
+    write_logs: bool = False,
+    lookahead: int = PREFETCH_LOOKAHEAD,
+) -> Dict[str, int]:
+    # partial cumulative balances over the change points [start, stop);
+    # the partials of all shards add up to the single run result
+    points = get_change_points(transfers, services, from_block, to_block)
+    verifier = Verifier()
+    for service in services:
+        service.verifier = verifier
+    seed_services(services, points, start)
+    return run_points(
+        vault,
+        transfers,
+        services,
+        points,
+        from_block,
+        to_block,
+        write_logs,
+        lookahead,
+        verifier,
+        start,
+        stop,
+    )
+
+
+def merge_balances(partials: List[Dict[str, int]]) -> Dict[str, int]:
+    # merged in shard order, so holders keep the order of a single run
+    cumulative_balances = {}
+    for partial in partials:
+        for holder, balance in partial.items():
+            cumulative_balances[holder] = cumulative_balances.get(holder, 0) + balance
+    return cumulative_balances
+
+
+def run_points(
+    vault: str,
+    transfers: List[Dict[str, Any]],
+    services: List[DeFiService],
+    points: List[int],
+    from_block: int,
+    to_block: int,
+    write_logs: bool,
+    lookahead: int,
+    verifier: Verifier,
+    start: int,
+    stop: int,
+    checkpoint: Optional[Dict[str, Any]] = None,
+    checkpoint_file: Optional[str] = None,
+) -> Dict[str, int]:
+    prefetcher = (
+        SnapshotPrefetcher(services, points[start:stop], lookahead)
+        if lookahead > 0
+        else None
+    )
+    try:
+        with profiler.stage("accumulate"):
+            cumulative_balances = accumulate_points(
+                vault,
+                transfers,
+                services,
+                points,
+                from_block,
+                to_block,
+                write_logs,
+                prefetcher,
+                verifier,
+                start,
+                stop,
+                checkpoint,
+                checkpoint_file,
+            )
+    except Exception:
+        verifier.close()
+        raise
+    finally:
+        if prefetcher is not None:
+            prefetcher.close()
+    # raises all discrepancies found by the checks together
+    verifier.finish()
+    return cumulative_balances
+
+
+def accumulate_points(
+    vault: str,
+    transfers: List[Dict[str, Any]],
+    services: List[DeFiService],
+    points: List[int],
+    from_block: int,
+    to_block: int,
+    write_logs: bool,
+    prefetcher: Optional[SnapshotPrefetcher],
+    verifier: Verifier,
+    start: int,
+    stop: int,
+    checkpoint: Optional[Dict[str, Any]] = None,
+    checkpoint_file: Optional[str] = None,
+) -> Dict[str, int]:
+    holder_balances = HolderBalances()
+    iterator = 0
+    saved_block_number = from_block
+    if checkpoint is not None:
+        holder_balances = HolderBalances.from_dicts(
+            checkpoint["user_balances"], checkpoint["cumulative_balances"]
+        )
+        iterator = checkpoint["transfer_iterator"]
+        saved_block_number = checkpoint["block_number"]
+    balances = holder_balances.balances
+    cumulative_balances = holder_balances.cumulative_balances
+    holders = holder_balances.holders
+    is_accumulated = holder_balances.is_accumulated
+    accumulated = holder_balances.accumulated
+    # pool id -> (distributions, defi user ids, defi shares, total defi shares),
+    # converted once per snapshot of the service
+    pool_shares: Dict[int, Tuple[List[Tuple[str, int]], List[int], List[int], int]] = {}
+    for index in range(start, stop):
+        block_number = points[index]
+        next_block_number = (
+            points[index + 1] if index + 1 < len(points) else to_block + 1
+        )
+        interval = next_block_number - block_number
+
+        while (
+            iterator < len(transfers)
+            and transfers[iterator]["block_number"] <= block_number
+        ):
+            holder_balances.apply_transfer(transfers[iterator])
+            iterator += 1
+
+        if is_checkpoint(block_number, from_block, to_block):
+            print("Processing {} / {}...".format(block_number, to_block))
+            user_balances = holder_balances.get_user_balances()
+            verifier.submit(
+                "balances at block {}".format(block_number),
+                lambda user_balances=user_balances, block_number=block_number: (
+                    get_balance_discrepancies(vault, user_balances, block_number)
+                ),
+            )
+
+        if prefetcher is not None:
+            for service, consumed_block_numbers, snapshot in prefetcher.get(
+                index - start
+            ):
+                service.consume_block_numbers(block_number)
+                service.timed_apply_snapshot(
+                    block_number, consumed_block_numbers, snapshot
+                )
+
+        for service in services:
+            defi_pool, distributions = service.calculate_distributions_with_logs(
+                block_number, write_logs
+            )
+            pool_id = holder_balances.get_id(defi_pool)
+            shares = pool_shares.get(pool_id)
+            # services hand out the same list until their next snapshot
+            if shares is None or shares[0] is not distributions:
+                defi_shares = [defi_share for _, defi_share in distributions]
+                pool_shares[pool_id] = (
+                    distributions,
+                    [
+                        holder_balances.get_id(defi_user)
+                        for defi_user, _ in distributions
+                    ],
+                    defi_shares,
+                    sum(defi_shares),
+                )
+
+        for holder_id in holders:
+            balance = balances[holder_id]
+            shares = pool_shares.get(holder_id)
+            if shares is None:
+                if not is_accumulated[holder_id]:
+                    is_accumulated[holder_id] = 1
+                    accumulated.append(holder_id)
+                cumulative_balances[holder_id] += interval * balance
+                continue
+            _, defi_user_ids, defi_shares, total_defi_shares = shares
+            for defi_user_id, defi_share in zip(defi_user_ids, defi_shares):
+                if not is_accumulated[defi_user_id]:
+                    is_accumulated[defi_user_id] = 1
+                    accumulated.append(defi_user_id)
+                cumulative_balances[defi_user_id] += interval * (
+                    balance * defi_share // total_defi_shares
+                )
+
+        if (
+            checkpoint_file is not None
+            and block_number - saved_block_number >= CHECKPOINT_INTERVAL
+            and index + 1 < stop
+        ):
+            save_checkpoint(
+                checkpoint_file,
+                {
+                    "vault": vault,
+                    "index": index,
+                    "block_number": block_number,
+                    "points": len(points),
+                    "transfer_iterator": iterator,
+                    "user_balances": holder_balances.get_user_balances(),
+                    "cumulative_balances": holder_balances.get_cumulative_balances(),
+                    "services": [service.get_state() for service in services],
+                    # pending checks are awaited so the checkpoint covers them
+                    "discrepancies": verifier.wait(),
+                },
+            )
+            saved_block_number = block_number
+
+    return holder_balances.get_cumulative_balances()
@@ -0,0 +1,115 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+from typing import List, Any, Dict, Optional
+
+from utils.blockscout import BlockscoutClient, get_blockscout_runner
+from utils.profiling import profiler
+
+EVENT_CACHE_PATH = os.getenv("EVENT_CACHE_PATH", "./cache/events.sqlite")
+
+
+class EventCache:
+    def __init__(self, path: str = EVENT_CACHE_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "endpoint TEXT NOT NULL, "
+            "block_number INTEGER NOT NULL, "
+            "payload TEXT NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS events_endpoint_block "
+            "ON events (endpoint, block_number, id)"
+        )
+        self.connection.commit()
+
+    def max_block_number(self, endpoint: str) -> Optional[int]:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT MAX(block_number) FROM events WHERE endpoint = ?",
+                (endpoint,),
+            ).fetchone()
+        # a hit only needs the blocks after the cached ones
+        profiler.count("event_cache.misses" if row[0] is None else "event_cache.hits")
+        return row[0]
+
+    def load(self, endpoint: str) -> List[Any]:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT payload FROM events WHERE endpoint = ? "
+                "ORDER BY block_number, id",
+                (endpoint,),
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def replace_from(self, endpoint: str, from_block: int, items: List[Any]) -> None:
+        # the last cached block may have been only partially indexed, so it
+        # is always dropped and re-inserted from the fresh response
+        with self.lock:
+            self.connection.execute(
+                "DELETE FROM events WHERE endpoint = ? AND block_number >= ?",
+                (endpoint, from_block),
+            )
+            self.connection.executemany(
+                "INSERT INTO events (endpoint, block_number, payload) VALUES (?, ?, ?)",
+                [
+                    (endpoint, int(item["block_number"]), json.dumps(item))
+                    for item in items
+                ],
+            )
+            self.connection.commit()
+
+
+_event_cache: Optional[EventCache] = None
+_event_cache_lock = threading.Lock()
+
+
+def get_event_cache() -> EventCache:
+    global _event_cache
+    with _event_cache_lock:
+        if _event_cache is None:
+            _event_cache = EventCache()
+    return _event_cache
+
+
+def get_endpoint_key(url: str, params: Dict[str, Any]) -> str:
+    return url + "?" + json.dumps(params, sort_keys=True)
+
+
+async def fetch_cached(
+    client: BlockscoutClient, url: str, params: Dict[str, Any] = {}
+) -> List[Any]:
+    cache = get_event_cache()
+    endpoint = get_endpoint_key(url, params)
+    from_block = cache.max_block_number(endpoint)
+    if from_block is None:
+        from_block = 0
+        items = await client.fetch_all(url, params)
+    else:
+        items = await client.fetch_since(url, from_block, params)
+    profiler.count("event_cache.fetched_items", len(items))
+    cache.replace_from(endpoint, from_block, items)
+    return cache.load(endpoint)
+
+
+async def fetch_cached_many(
+    client: BlockscoutClient, urls: List[str], params: Dict[str, Any] = {}
+) -> List[List[Any]]:
+    return await asyncio.gather(*[fetch_cached(client, url, params) for url in urls])
+
+
+def call_blockscout_api_many_cached(
+    urls: List[str], params: Dict[str, Any] = {}
+) -> List[List[Any]]:
+    # independent endpoints are scanned concurrently by the client of the
+    # process, bounded by its connection limit
+    runner = get_blockscout_runner()
+    return runner.run(fetch_cached_many(runner.client, urls, params))
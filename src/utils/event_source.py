@@ -0,0 +1,309 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Any, Callable, Dict, Optional, Tuple
+
+from eth_abi.abi import decode
+from web3 import Web3
+
+from utils.event_cache import get_event_cache, call_blockscout_api_many_cached
+from utils.profiling import profiler
+
+LOGS_BLOCK_RANGE = 10000
+MAX_WORKERS = 8
+MAX_SCANS = 4
+TRANSFER_TOPIC = (
+    "0x" + Web3.keccak(text="Transfer(address,address,uint256)").hex()[-64:]
+)
+
+
+def get_abi_type(abi_input: Dict[str, Any]) -> str:
+    abi_type = abi_input["type"]
+    if abi_type.startswith("tuple"):
+        components = ",".join(
+            get_abi_type(component) for component in abi_input["components"]
+        )
+        return "({}){}".format(components, abi_type[len("tuple") :])
+    return abi_type
+
+
+def get_event_topic(event: Dict[str, Any]) -> str:
+    signature = "{}({})".format(
+        event["name"], ",".join(get_abi_type(item) for item in event["inputs"])
+    )
+    return "0x" + Web3.keccak(text=signature).hex()[-64:]
+
+
+def get_method_call(event: Dict[str, Any]) -> str:
+    # same format as the decoded method_call of Blockscout
+    return "{}({})".format(
+        event["name"],
+        ", ".join(
+            "{}{} {}".format(
+                get_abi_type(item),
+                " indexed" if item.get("indexed") else "",
+                item["name"],
+            )
+            for item in event["inputs"]
+        ),
+    )
+
+
+def format_value(abi_input: Dict[str, Any], value: Any) -> Any:
+    abi_type = abi_input["type"]
+    if abi_type.endswith("[]"):
+        item = {**abi_input, "type": abi_type[:-2]}
+        return [format_value(item, x) for x in value]
+    if abi_type == "tuple":
+        return [
+            format_value(component, x)
+            for component, x in zip(abi_input["components"], value)
+        ]
+    if abi_type == "address":
+        return Web3.to_checksum_address(value)
+    if abi_type.startswith("bytes"):
+        return "0x" + value.hex()
+    if abi_type.startswith("int") or abi_type.startswith("uint"):
+        return str(value)
+    return value
+
+
+def topic_to_address(topic: bytes) -> str:
+    return Web3.to_checksum_address(bytes(topic)[-20:])
+
+
+def decode_log(
+    log: Dict[str, Any], events: Dict[str, Dict[str, Any]]
+) -> Optional[Dict[str, Any]]:
+    topics = log["topics"]
+    if not topics:
+        return None
+    event = events.get("0x" + bytes(topics[0]).hex())
+    if event is None:
+        return None
+    indexed_inputs = [item for item in event["inputs"] if item.get("indexed")]
+    data_inputs = [item for item in event["inputs"] if not item.get("indexed")]
+    if len(indexed_inputs) != len(topics) - 1:
+        # same signature with a different set of indexed parameters
+        return None
+    values = {}
+    for item, topic in zip(indexed_inputs, topics[1:]):
+        values[item["name"]] = decode([get_abi_type(item)], bytes(topic))[0]
+    data_values = decode(
+        [get_abi_type(item) for item in data_inputs], bytes(log["data"])
+    )
+    for item, value in zip(data_inputs, data_values):
+        values[item["name"]] = value
+    return {
+        "method_call": get_method_call(event),
+        "parameters": [
+            {
+                "name": item["name"],
+                "type": get_abi_type(item),
+                "indexed": bool(item.get("indexed")),
+                "value": format_value(item, values[item["name"]]),
+            }
+            for item in event["inputs"]
+        ],
+    }
+
+
+# ("token_transfers", token, None) or ("logs", address, abi)
+EventScan = Tuple[str, str, Optional[List[Dict[str, Any]]]]
+
+
+class EventSource:
+    # scans are fetched once per process: prefetch gets independent scans
+    # concurrently and later token_transfers and logs calls of the run are
+    # answered from memory
+    def __init__(self):
+        self.fetched: Dict[Tuple[str, str], List[Any]] = {}
+        self.fetched_lock = threading.Lock()
+
+    def token_transfers(self, token: str) -> List[Any]:
+        return self.get_scans([("token_transfers", token, None)])[0]
+
+    def logs(self, address: str, abi: List[Dict[str, Any]]) -> List[Any]:
+        return self.get_scans([("logs", address, abi)])[0]
+
+    def prefetch(self, scans: List[EventScan]) -> None:
+        self.get_scans(scans)
+
+    def get_scans(self, scans: List[EventScan]) -> List[List[Any]]:
+        keys = [(kind, Web3.to_checksum_address(address)) for kind, address, _ in scans]
+        missing = {}
+        with self.fetched_lock:
+            for key, scan in zip(keys, scans):
+                if key not in self.fetched:
+                    missing[key] = scan
+        if missing:
+            responses = self.fetch_scans(list(missing.values()))
+            with self.fetched_lock:
+                self.fetched.update(zip(missing.keys(), responses))
+        with self.fetched_lock:
+            return [self.fetched[key] for key in keys]
+
+    def fetch_scans(self, scans: List[EventScan]) -> List[List[Any]]:
+        pass
+
+
+class BlockscoutEventSource(EventSource):
+    def __init__(self, api_url: str):
+        super().__init__()
+        self.api_url = api_url
+
+    def get_url(self, scan: EventScan) -> str:
+        kind, address, _ = scan
+        if kind == "token_transfers":
+            return f"{self.api_url}/tokens/{address}/transfers"
+        # decoded by Blockscout, the abi is only needed for raw logs
+        return f"{self.api_url}/addresses/{address}/logs"
+
+    def fetch_scans(self, scans: List[EventScan]) -> List[List[Any]]:
+        return call_blockscout_api_many_cached([self.get_url(scan) for scan in scans])
+
+
+class RpcEventSource(EventSource):
+    # reads raw logs with eth_getLogs over parallel block ranges and
+    # normalizes them into the same records as the Blockscout api
+    def __init__(
+        self,
+        w3: Web3,
+        from_block: int = 0,
+        block_range: int = LOGS_BLOCK_RANGE,
+        max_workers: int = MAX_WORKERS,
+    ):
+        super().__init__()
+        self.w3 = w3
+        self.from_block = from_block
+        self.block_range = block_range
+        self.max_workers = max_workers
+        self.lock = threading.Lock()
+
+    def get_logs_range(
+        self, filter_params: Dict[str, Any], from_block: int, to_block: int
+    ) -> List[Any]:
+        try:
+            return self.w3.eth.get_logs(
+                {**filter_params, "fromBlock": from_block, "toBlock": to_block}
+            )
+        except Exception as e:
+            if from_block == to_block:
+                raise
+            # the range hit the result or range limit of the node, so remember
+            # the smaller range for the following requests as well
+            middle = (from_block + to_block) >> 1
+            with self.lock:
+                self.block_range = min(self.block_range, middle - from_block + 1)
+            print(
+                "RpcEventSource: logs of blocks {}-{} failed, splitting: {}".format(
+                    from_block, to_block, e
+                )
+            )
+            return self.get_logs_range(
+                filter_params, from_block, middle
+            ) + self.get_logs_range(filter_params, middle + 1, to_block)
+
+    def get_logs(
+        self, filter_params: Dict[str, Any], from_block: int, to_block: int
+    ) -> List[Any]:
+        ranges: List[Tuple[int, int]] = []
+        start = from_block
+        while start <= to_block:
+            end = min(start + self.block_range - 1, to_block)
+            ranges.append((start, end))
+            start = end + 1
+        if not ranges:
+            return []
+        stage = profiler.get_stage()
+
+        def get_logs_range(item: Tuple[int, int]) -> List[Any]:
+            with profiler.within(stage):
+                return self.get_logs_range(filter_params, item[0], item[1])
+
+        with ThreadPoolExecutor(min(self.max_workers, len(ranges))) as executor:
+            responses = executor.map(get_logs_range, ranges)
+            return [log for logs in responses for log in logs]
+
+    def fetch_cached(
+        self,
+        endpoint: str,
+        filter_params: Dict[str, Any],
+        normalize: Callable[[Any], Dict[str, Any]],
+    ) -> List[Any]:
+        cache = get_event_cache()
+        from_block = cache.max_block_number(endpoint)
+        if from_block is None:
+            from_block = self.from_block
+        to_block = self.w3.eth.block_number
+        items = [
+            normalize(log) for log in self.get_logs(filter_params, from_block, to_block)
+        ]
+        profiler.count("event_cache.fetched_items", len(items))
+        cache.replace_from(endpoint, from_block, items)
+        return cache.load(endpoint)
+
+    def fetch_scans(self, scans: List[EventScan]) -> List[List[Any]]:
+        stage = profiler.get_stage()
+
+        def fetch_scan(scan: EventScan) -> List[Any]:
+            kind, address, abi = scan
+            with profiler.within(stage):
+                if kind == "token_transfers":
+                    return self.fetch_token_transfers(address)
+                return self.fetch_logs(address, abi)
+
+        if len(scans) == 1:
+            return [fetch_scan(scans[0])]
+        with ThreadPoolExecutor(min(MAX_SCANS, len(scans))) as executor:
+            return list(executor.map(fetch_scan, scans))
+
+    def fetch_token_transfers(self, token: str) -> List[Any]:
+        def normalize(log: Dict[str, Any]) -> Dict[str, Any]:
+            topics = log["topics"]
+            if len(topics) == 4:
+                # erc721, the token id is indexed
+                total = {"token_id": str(int.from_bytes(bytes(topics[3]), "big"))}
+            else:
+                total = {"value": str(int.from_bytes(bytes(log["data"]), "big"))}
+            return {
+                "block_number": log["blockNumber"],
+                "transaction_hash": "0x" + bytes(log["transactionHash"]).hex(),
+                "log_index": log["logIndex"],
+                "from": {"hash": topic_to_address(topics[1])},
+                "to": {"hash": topic_to_address(topics[2])},
+                "total": total,
+            }
+
+        token = Web3.to_checksum_address(token)
+        return self.fetch_cached(
+            f"rpc:{token}/transfers",
+            {"address": token, "topics": [TRANSFER_TOPIC]},
+            normalize,
+        )
+
+    def fetch_logs(self, address: str, abi: List[Dict[str, Any]]) -> List[Any]:
+        events = {
+            get_event_topic(item): item for item in abi if item["type"] == "event"
+        }
+
+        def normalize(log: Dict[str, Any]) -> Dict[str, Any]:
+            return {
+                "block_number": log["blockNumber"],
+                "transaction_hash": "0x" + bytes(log["transactionHash"]).hex(),
+                "index": log["logIndex"],
+                "address": {"hash": Web3.to_checksum_address(log["address"])},
+                "decoded": decode_log(log, events),
+            }
+
+        address = Web3.to_checksum_address(address)
+        return self.fetch_cached(f"rpc:{address}/logs", {"address": address}, normalize)
+
+
+def create_event_source(
+    name: str, w3: Web3, api_url: str, from_block: int = 0
+) -> EventSource:
+    if name == "blockscout":
+        return BlockscoutEventSource(api_url)
+    if name == "rpc":
+        return RpcEventSource(w3, from_block)
+    raise Exception("EventSource: unknown event source {}".format(name))
@@ -0,0 +1,73 @@
+from typing import List, Any, Dict
+
+from utils.common import ZERO_ADDRESS
+
+
+class HolderBalances:
+    # holder and cumulative balances in flat lists indexed by dense address
+    # ids; holders and accumulated addresses keep the insertion order the
+    # dicts they replace had, so results are identical
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.addresses: List[str] = []
+        self.balances: List[int] = []
+        self.cumulative_balances: List[int] = []
+        self.is_holder = bytearray()
+        self.holders: List[int] = []
+        self.is_accumulated = bytearray()
+        self.accumulated: List[int] = []
+
+    def get_id(self, address: str) -> int:
+        address_id = self.ids.get(address)
+        if address_id is None:
+            address_id = len(self.addresses)
+            self.ids[address] = address_id
+            self.addresses.append(address)
+            self.balances.append(0)
+            self.cumulative_balances.append(0)
+            self.is_holder.append(0)
+            self.is_accumulated.append(0)
+        return address_id
+
+    def add_balance(self, address: str, amount: int) -> None:
+        address_id = self.get_id(address)
+        if not self.is_holder[address_id]:
+            self.is_holder[address_id] = 1
+            self.holders.append(address_id)
+        self.balances[address_id] += amount
+
+    def apply_transfer(self, transfer: Dict[str, Any]) -> None:
+        if transfer["from"] != ZERO_ADDRESS:
+            self.add_balance(transfer["from"], -transfer["amount"])
+        if transfer["to"] != ZERO_ADDRESS:
+            self.add_balance(transfer["to"], transfer["amount"])
+
+    def add_cumulative_balance(self, address: str, amount: int) -> None:
+        address_id = self.get_id(address)
+        if not self.is_accumulated[address_id]:
+            self.is_accumulated[address_id] = 1
+            self.accumulated.append(address_id)
+        self.cumulative_balances[address_id] += amount
+
+    def get_user_balances(self) -> Dict[str, int]:
+        return {
+            self.addresses[address_id]: self.balances[address_id]
+            for address_id in self.holders
+        }
+
+    def get_cumulative_balances(self) -> Dict[str, int]:
+        return {
+            self.addresses[address_id]: self.cumulative_balances[address_id]
+            for address_id in self.accumulated
+        }
+
+    @staticmethod
+    def from_dicts(
+        user_balances: Dict[str, int], cumulative_balances: Dict[str, int]
+    ) -> "HolderBalances":
+        holder_balances = HolderBalances()
+        for address, balance in user_balances.items():
+            holder_balances.add_balance(address, balance)
+        for address, balance in cumulative_balances.items():
+            holder_balances.add_cumulative_balance(address, balance)
+        return holder_balances
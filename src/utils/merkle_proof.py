@@ -1,43 +1,134 @@
 from hexbytes import HexBytes
-from web3 import Web3
-from typing import List
-from eth_abi import encode
+from typing import List, Any, Dict, Iterable, Iterator, Optional, Set, Tuple
+from Crypto.Hash import keccak
 import csv
 import os
 import json
 
 
-def generate_merkle_tree(users: List[str], balances: List[int], reward_token: str):
-    n = len(users)
-    cache = [
-        Web3.keccak(
-            Web3.keccak(
-                encode(
-                    ["address", "address", "uint256"],
-                    [users[i], reward_token, balances[i]],
-                )
-            )
-        )
-        for i in range(n)
-    ]
-    sorted_hashes = sorted(cache.copy())
-    tree = [HexBytes(0x0) for _ in range(2 * n - 1)]
-    for i in range(n):
-        tree[len(tree) - 1 - i] = sorted_hashes[i]
-
-    for i in range(n, 2 * n - 1):
-        v = len(tree) - 1 - i
-        left_hash = tree[v * 2 + 1]
-        right_hash = tree[v * 2 + 2]
+def keccak_batch(data: bytearray, item_size: int) -> bytearray:
+    # hashes every consecutive item_size-byte chunk of data straight from
+    # the buffer, without a web3 dispatch or a bytes copy per item
+    count = len(data) // item_size
+    digests = bytearray(32 * count)
+    view = memoryview(data)
+    for i in range(count):
+        digests[i * 32 : (i + 1) * 32] = keccak.new(
+            data=view[i * item_size : (i + 1) * item_size], digest_bits=256
+        ).digest()
+    return digests
+
+
+def get_address_word(address: str) -> bytes:
+    value = bytes.fromhex(address[2:])
+    if len(value) != 20:
+        raise ValueError("Invalid address: {}".format(address))
+    return bytes(12) + value
+
+
+def hash_pairs(children: bytes) -> bytearray:
+    # parent hashes of consecutive (left, right) children, each pair sorted
+    pairs = bytearray()
+    for offset in range(0, len(children), 64):
+        left_hash = children[offset : offset + 32]
+        right_hash = children[offset + 32 : offset + 64]
         if left_hash > right_hash:
             left_hash, right_hash = right_hash, left_hash
-        tree[v] = Web3.keccak(encode(["bytes32", "bytes32"], [left_hash, right_hash]))
+        pairs += left_hash
+        pairs += right_hash
+    return keccak_batch(pairs, 64)
+
+
+class MerkleTree:
+    # nodes are kept as one flat buffer of 32-byte words in heap order:
+    # node v has children 2v + 1 and 2v + 2, sorted leaves fill the tail.
+    # Given the previous tree of the same size, only the paths above the
+    # leaf slots whose content changed are re-hashed
+    def __init__(self, leaves: List[bytes], previous: Optional["MerkleTree"] = None):
+        n = len(leaves)
+        self.n = n
+        self.leaves = leaves
+        self.positions: Dict[bytes, int] = {}
+        sorted_leaves = sorted(leaves)
+        for index, leaf in enumerate(sorted_leaves):
+            self.positions.setdefault(leaf, index)
+        tail = b"".join(reversed(sorted_leaves))
+
+        if previous is not None and previous.n == n and n > 1:
+            self.nodes = bytearray(previous.nodes)
+            changed = [
+                index
+                for index in range(n - 1, 2 * n - 1)
+                if self.nodes[index * 32 : (index + 1) * 32]
+                != tail[(index - n + 1) * 32 : (index - n + 2) * 32]
+            ]
+            self.nodes[32 * (n - 1) :] = tail
+            self.rehash(changed)
+            return
+
+        self.nodes = bytearray(32 * max(2 * n - 1, 0))
+        self.nodes[32 * (n - 1) :] = tail
+        # every heap level is a contiguous range of nodes whose children all
+        # live one level deeper, so each level is hashed as a single batch
+        level = (n - 1).bit_length() - 1
+        while level >= 0:
+            start = (1 << level) - 1
+            end = min((1 << (level + 1)) - 2, n - 2)
+            self.nodes[start * 32 : (end + 1) * 32] = hash_pairs(
+                self.nodes[(2 * start + 1) * 32 : (2 * end + 3) * 32]
+            )
+            level -= 1
+
+    @staticmethod
+    def from_nodes(nodes: bytes) -> "MerkleTree":
+        # a tree saved with its nodes, without hashing; leaves are in
+        # sorted order
+        tree = MerkleTree.__new__(MerkleTree)
+        n = (len(nodes) // 32 + 1) // 2
+        tree.n = n
+        tree.nodes = bytearray(nodes)
+        tree.leaves = [tree.node(2 * n - 2 - i) for i in range(n)]
+        tree.positions = {}
+        for index, leaf in enumerate(tree.leaves):
+            tree.positions.setdefault(leaf, index)
+        return tree
+
+    def rehash(self, indices: List[int]) -> None:
+        # re-hashes the ancestors of the given nodes, one batch per level
+        # from the deepest one up
+        levels: Dict[int, Set[int]] = {}
+        for index in indices:
+            if index:
+                parent = (index - 1) >> 1
+                levels.setdefault((parent + 1).bit_length() - 1, set()).add(parent)
+        level = max(levels, default=-1)
+        while level >= 0:
+            parents = sorted(levels.get(level, []))
+            children = b"".join(
+                self.nodes[(2 * parent + 1) * 32 : (2 * parent + 3) * 32]
+                for parent in parents
+            )
+            digests = hash_pairs(children)
+            for i, parent in enumerate(parents):
+                self.nodes[parent * 32 : (parent + 1) * 32] = digests[
+                    i * 32 : (i + 1) * 32
+                ]
+                if parent:
+                    levels.setdefault(level - 1, set()).add((parent - 1) >> 1)
+            level -= 1
 
-    root = tree[0]
-    proofs = []
-    for i in range(n):
-        index = sorted_hashes.index(cache[i])
-        tree_index = len(tree) - 1 - index
+    def node(self, index: int) -> bytes:
+        return bytes(self.nodes[index * 32 : (index + 1) * 32])
+
+    @property
+    def root(self) -> bytes:
+        return self.node(0)
+
+    def proof(self, i: int) -> List[bytes]:
+        return self.leaf_proof(self.leaves[i])
+
+    def leaf_proof(self, leaf: bytes) -> List[bytes]:
+        tree_index = 2 * self.n - 2 - self.positions[leaf]
         proof = []
         while tree_index:
             sibling_index = tree_index
@@ -45,10 +136,171 @@ def generate_merkle_tree(users: List[str], balances: List[int], reward_token: st
                 sibling_index -= 1
             else:
                 sibling_index += 1
-            proof.append(tree[sibling_index])
+            proof.append(self.node(sibling_index))
             tree_index = (tree_index - 1) >> 1
-        proofs.append(proof)
-    return root, proofs
+        return proof
+
+    def proofs(self) -> Iterator[List[bytes]]:
+        for i in range(self.n):
+            yield self.proof(i)
+
+
+def get_leaves(users: List[str], balances: List[int], reward_token: str) -> List[bytes]:
+    # keccak(keccak(abi.encode(user, reward_token, balance))) for every user,
+    # packed into one contiguous buffer of 96-byte encodings
+    reward_token_word = get_address_word(reward_token)
+    encodings = bytearray(
+        b"".join(
+            get_address_word(users[i])
+            + reward_token_word
+            + balances[i].to_bytes(32, "big")
+            for i in range(len(users))
+        )
+    )
+    digests = keccak_batch(keccak_batch(encodings, 96), 32)
+    return [bytes(digests[i * 32 : (i + 1) * 32]) for i in range(len(users))]
+
+
+def build_merkle_tree(
+    users: List[str], balances: List[int], reward_token: str
+) -> MerkleTree:
+    return MerkleTree(get_leaves(users, balances, reward_token))
+
+
+def generate_merkle_tree(users: List[str], balances: List[int], reward_token: str):
+    tree = build_merkle_tree(users, balances, reward_token)
+    return HexBytes(tree.root), [
+        [HexBytes(node) for node in proof] for proof in tree.proofs()
+    ]
+
+
+def write_merkle_proofs(
+    file_name: str,
+    tree: MerkleTree,
+    users: List[str],
+    balances: List[int],
+    reward_token: str,
+    indices: Optional[Iterable[int]] = None,
+    header: Dict[str, str] = {},
+) -> None:
+    # streams the same layout json.dump(..., indent=2) would produce, one
+    # entry at a time, so proofs never have to be held in memory at once
+    with open(file_name, "w") as f:
+        f.write('{\n  "root": ' + json.dumps("0x" + tree.root.hex()))
+        for key, value in header.items():
+            f.write(",\n  " + json.dumps(key) + ": " + json.dumps(value))
+        f.write(',\n  "data": [')
+        count = 0
+        for i in range(tree.n) if indices is None else indices:
+            entry = {
+                "address": users[i],
+                "reward": reward_token,
+                "amount": str(balances[i]),
+                "proof": ["0x" + node.hex() for node in tree.proof(i)],
+            }
+            f.write("," if count else "")
+            f.write("\n    " + json.dumps(entry, indent=2).replace("\n", "\n    "))
+            count += 1
+        f.write("\n  ]\n}" if count else "]\n}")
+
+
+def load_ledger(file_name: str, vault: str, reward_token: str) -> Dict[str, Any]:
+    # cumulative rewards of a vault in a single reward token, together with
+    # the epochs already applied and the leaf hash of every user
+    if not os.path.exists(file_name):
+        return {
+            "vault": vault,
+            "reward_token": reward_token,
+            "root": None,
+            "epochs": [],
+            "balances": {},
+            "leaves": {},
+        }
+    with open(file_name, "r") as f:
+        return json.load(f)
+
+
+def save_ledger(file_name: str, ledger: Dict[str, Any]) -> None:
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+    with open(file_name, "w") as f:
+        json.dump(ledger, f, indent=2)
+
+
+def read_distribution(label: str, vault: str) -> Iterator[Tuple[str, int]]:
+    # the columnar file when the epoch was computed locally, the csv else
+    from utils.columnar import DistributionFile, get_distribution_path
+
+    file_name = get_distribution_path(label, vault)
+    if os.path.exists(file_name):
+        distribution = DistributionFile(file_name)
+        try:
+            yield from distribution.items()
+        finally:
+            distribution.close()
+        return
+    with open(f"{label}/{vault}.csv", "r") as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield row["user"], int(row["reward"])
+
+
+def apply_epoch(ledger: Dict[str, Any], label: str) -> Set[str]:
+    changed_users = set()
+    balances = ledger["balances"]
+    for user, balance in read_distribution(label, ledger["vault"]):
+        balances[user] = str(int(balances.get(user, "0")) + balance)
+        changed_users.add(user)
+    ledger["epochs"].append(label)
+    return changed_users
+
+
+def update_leaves(ledger: Dict[str, Any], changed_users: Set[str]) -> None:
+    users = sorted(changed_users)
+    balances = [int(ledger["balances"][user]) for user in users]
+    leaves = get_leaves(users, balances, ledger["reward_token"])
+    for user, leaf in zip(users, leaves):
+        ledger["leaves"][user] = "0x" + leaf.hex()
+
+
+def get_ledger_tree(
+    ledger: Dict[str, Any], users: List[str], previous: Optional[MerkleTree] = None
+) -> MerkleTree:
+    return MerkleTree(
+        [bytes.fromhex(ledger["leaves"][user][2:]) for user in users], previous
+    )
+
+
+def load_tree(file_name: str) -> Optional[MerkleTree]:
+    if not os.path.exists(file_name):
+        return None
+    with open(file_name, "rb") as f:
+        return MerkleTree.from_nodes(f.read())
+
+
+def save_tree(file_name: str, tree: MerkleTree) -> None:
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+    with open(file_name, "wb") as f:
+        f.write(tree.nodes)
+
+
+def get_changed_proofs(
+    previous_leaves: Dict[str, str],
+    previous_tree: Optional[MerkleTree],
+    tree: MerkleTree,
+    users: List[str],
+) -> List[int]:
+    # leaves are laid out in sorted order, so any new or updated leaf can
+    # shift the position and therefore the proof of an untouched user too
+    if previous_tree is None:
+        return list(range(tree.n))
+    changed = []
+    for i, user in enumerate(users):
+        previous_leaf = previous_leaves.get(user)
+        if previous_leaf is None or tree.leaves[i] != bytes.fromhex(previous_leaf[2:]):
+            changed.append(i)
+        elif previous_tree.leaf_proof(tree.leaves[i]) != tree.proof(i):
+            changed.append(i)
+    return changed
 
 
 def convert_to_str(value: HexBytes) -> str:
@@ -62,8 +314,14 @@ def convert_to_str(value: HexBytes) -> str:
 
 
 if __name__ == "__main__":
+    import sys
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from utils.columnar import write_proofs
+
     labels = [f"./distributions/lisk/{i}/external" for i in [1, 2, 3]]
     merkle_proofs_path = labels[-1].replace("external", "merkle_proofs")
+    ledger_path = "./distributions/lisk/ledger"
     vaults = [
         "0x1b10E2270780858923cdBbC9B5423e29fffD1A44",
         "0x8cf94b5A37b1835D634b7a3e6b1EE02Ce7F0CD30",
@@ -72,18 +330,31 @@ if __name__ == "__main__":
     reward_token = "0xac485391EB2d7D88253a7F1eF18C37f4242D1A24"
 
     for vault in vaults:
-        data = {}
+        ledger_file_name = f"{ledger_path}/{vault}_{reward_token}.json"
+        tree_file_name = f"{ledger_path}/{vault}_{reward_token}.nodes"
+        ledger = load_ledger(ledger_file_name, vault, reward_token)
+        previous_root = ledger["root"]
+        previous_leaves = dict(ledger["leaves"])
+
+        changed_users = set()
         for label in labels:
-            with open(f"{label}/{vault}.csv", "r") as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    user = row["user"]
-                    balance = int(row["reward"])
-                    if user not in data:
-                        data[user] = 0
-                    data[user] += balance
+            if label not in ledger["epochs"]:
+                changed_users |= apply_epoch(ledger, label)
+        if not changed_users:
+            print("{}: no new epoch".format(vault))
+            continue
+        update_leaves(ledger, changed_users)
+
+        previous_tree = load_tree(tree_file_name)
+        if previous_tree is None and previous_leaves:
+            # ledgers written before the tree nodes were saved
+            previous_tree = MerkleTree(
+                [bytes.fromhex(leaf[2:]) for leaf in previous_leaves.values()]
+            )
+
         sorted_balances = sorted(
-            [(balance, user) for user, balance in data.items()], reverse=True
+            [(int(balance), user) for user, balance in ledger["balances"].items()],
+            reverse=True,
         )
         users = []
         balances = []
@@ -92,23 +363,28 @@ if __name__ == "__main__":
             users.append(user)
             balances.append(balance)
 
-        merkle_root, proofs = generate_merkle_tree(users, balances, reward_token)
-        data = {
-            "root": convert_to_str(merkle_root),
-            "data": [
-                {
-                    "address": users[i],
-                    "reward": reward_token,
-                    "amount": str(balances[i]),
-                    "proof": [convert_to_str(x) for x in proofs[i]],
-                }
-                for i in range(len(users))
-            ],
-        }
-
+        tree = get_ledger_tree(ledger, users, previous_tree)
+        ledger["root"] = "0x" + tree.root.hex()
         os.makedirs(f"{merkle_proofs_path}", exist_ok=True)
-        with open(
-            f"{merkle_proofs_path}/{vault}.json",
-            "w",
-        ) as f:
-            json.dump(data, f, indent=2)
+        write_merkle_proofs(
+            f"{merkle_proofs_path}/{vault}.json", tree, users, balances, reward_token
+        )
+        write_proofs(
+            f"{merkle_proofs_path}/{vault}.bin",
+            tree.root,
+            reward_token,
+            users,
+            balances,
+            tree.proofs(),
+        )
+        write_merkle_proofs(
+            f"{merkle_proofs_path}/{vault}.diff.json",
+            tree,
+            users,
+            balances,
+            reward_token,
+            indices=get_changed_proofs(previous_leaves, previous_tree, tree, users),
+            header={"previous_root": previous_root},
+        )
+        save_tree(tree_file_name, tree)
+        save_ledger(ledger_file_name, ledger)
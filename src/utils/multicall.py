@@ -0,0 +1,164 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Any, Tuple
+from web3.eth import Contract
+
+from utils.profiling import profiler
+
+MAX_CALLS_PER_CHUNK = 1000
+MAX_CALLDATA_PER_CHUNK = 128 * 1024
+MAX_WORKERS = 8
+MAX_RETRIES = 4
+INITIAL_BACKOFF = 0.5
+MAX_BACKOFF = 8.0
+# full-size chunks that have to succeed in a row before the size grows back
+GROW_AFTER = 20
+# errors of a chunk that asks too much of the node: gas, payload or
+# response size limits. Anything else is retried as it is
+LIMIT_ERRORS = [
+    "out of gas",
+    "gas required exceeds",
+    "gas limit",
+    "too large",
+    "size limit",
+    "exceeds the limit",
+    "413",
+]
+
+
+def is_limit_error(error: Exception) -> bool:
+    message = str(error).lower()
+    return any(limit_error in message for limit_error in LIMIT_ERRORS)
+
+
+def get_calldata_size(call: List[Any]) -> int:
+    call_data = call[1]
+    if isinstance(call_data, str):
+        return (len(call_data) - 2) // 2
+    return len(call_data)
+
+
+class MulticallExecutor:
+    def __init__(
+        self,
+        multi_call: Contract,
+        max_calls: int = MAX_CALLS_PER_CHUNK,
+        max_calldata: int = MAX_CALLDATA_PER_CHUNK,
+        max_workers: int = MAX_WORKERS,
+        max_retries: int = MAX_RETRIES,
+    ):
+        self.multi_call = multi_call
+        self.initial_max_calls = max_calls
+        self.max_calls = max_calls
+        self.max_calldata = max_calldata
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.successes = 0
+        self.lock = threading.Lock()
+
+    def split(self, calls: List[List[Any]]) -> List[Tuple[int, int]]:
+        chunks = []
+        start = 0
+        calldata = 0
+        for index, call in enumerate(calls):
+            size = get_calldata_size(call)
+            if index > start and (
+                index - start >= self.max_calls or calldata + size > self.max_calldata
+            ):
+                chunks.append((start, index))
+                start = index
+                calldata = 0
+            calldata += size
+        if start < len(calls):
+            chunks.append((start, len(calls)))
+        return chunks
+
+    def execute_chunk(
+        self, calls: List[List[Any]], block_number: int
+    ) -> List[Tuple[bool, bytes]]:
+        backoff = INITIAL_BACKOFF
+        for attempt in range(self.max_retries + 1):
+            try:
+                responses = self.multi_call.functions.tryAggregate(False, calls).call(
+                    block_identifier=block_number
+                )
+            except Exception as e:
+                if is_limit_error(e):
+                    if len(calls) == 1:
+                        raise
+                    return self.split_chunk(calls, block_number, e)
+                if attempt == self.max_retries:
+                    raise Exception(
+                        "Multicall: {} calls failed at block {} after {} retries".format(
+                            len(calls), block_number, self.max_retries
+                        )
+                    ) from e
+                print(
+                    "Multicall: chunk of {} calls failed at block {}, retrying: {}".format(
+                        len(calls), block_number, e
+                    )
+                )
+                time.sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+                continue
+            self.record_success(len(calls))
+            return responses
+
+    def split_chunk(
+        self, calls: List[List[Any]], block_number: int, error: Exception
+    ) -> List[Tuple[bool, bytes]]:
+        # the chunk hit a gas or size limit of the node, so remember the
+        # smaller size for the following requests as well
+        half = len(calls) >> 1
+        with self.lock:
+            self.max_calls = min(self.max_calls, half)
+            self.successes = 0
+        print(
+            "Multicall: chunk of {} calls failed at block {}, splitting: {}".format(
+                len(calls), block_number, error
+            )
+        )
+        return self.execute_chunk(calls[:half], block_number) + self.execute_chunk(
+            calls[half:], block_number
+        )
+
+    def record_success(self, size: int) -> None:
+        # the limit may have come from a busy node, so the chunk size is
+        # doubled again after a run of full-size chunks went through
+        with self.lock:
+            if size < self.max_calls or self.max_calls >= self.initial_max_calls:
+                return
+            self.successes += 1
+            if self.successes >= GROW_AFTER:
+                self.max_calls = min(self.initial_max_calls, self.max_calls * 2)
+                self.successes = 0
+
+    def try_aggregate(
+        self, calls: List[List[Any]], block_number: int
+    ) -> List[Tuple[bool, bytes]]:
+        chunks = self.split(calls)
+        profiler.count("multicall.calls", len(calls))
+        profiler.count("multicall.chunks", len(chunks))
+        if len(chunks) <= 1:
+            return self.execute_chunk(calls, block_number) if calls else []
+        stage = profiler.get_stage()
+
+        def execute_chunk(chunk: Tuple[int, int]) -> List[Tuple[bool, bytes]]:
+            with profiler.within(stage):
+                return self.execute_chunk(calls[chunk[0] : chunk[1]], block_number)
+
+        with ThreadPoolExecutor(min(self.max_workers, len(chunks))) as executor:
+            responses = executor.map(execute_chunk, chunks)
+            return [response for chunk in responses for response in chunk]
+
+    def aggregate(self, calls: List[List[Any]], block_number: int) -> List[bytes]:
+        responses = self.try_aggregate(calls, block_number)
+        for index, (success, _) in enumerate(responses):
+            if not success:
+                raise Exception(
+                    "Multicall: call to {} failed at block {}".format(
+                        calls[index][0], block_number
+                    )
+                )
+        return [response for _, response in responses]
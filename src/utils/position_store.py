@@ -0,0 +1,81 @@
+import csv
+import os
+import sqlite3
+import threading
+from typing import List, Any, Dict, Optional
+
+POSITION_STORE_PATH = os.getenv("POSITION_STORE_PATH", "./cache/positions.sqlite")
+
+
+class PositionStore:
+    # append-only store of position manager nfts, indexed by the pool key so
+    # a pool's token ids are read without scanning every position
+    def __init__(
+        self, path: str = POSITION_STORE_PATH, seed_path: Optional[str] = None
+    ):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS positions ("
+            "token_id INTEGER PRIMARY KEY, "
+            "token0 TEXT NOT NULL, "
+            "token1 TEXT NOT NULL, "
+            "tick_spacing INTEGER NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS positions_pool "
+            "ON positions (token0, token1, tick_spacing)"
+        )
+        self.connection.commit()
+        if seed_path is not None and len(self) == 0 and os.path.exists(seed_path):
+            with open(seed_path, "r") as f:
+                self.add(list(csv.DictReader(f)))
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM positions").fetchone()[
+                0
+            ]
+
+    def add(self, positions: List[Dict[str, Any]]) -> None:
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO positions "
+                "(token_id, token0, token1, tick_spacing) VALUES (?, ?, ?, ?)",
+                [
+                    (
+                        int(position["tokenId"]),
+                        position["token0"].lower(),
+                        position["token1"].lower(),
+                        int(position["tickSpacing"]),
+                    )
+                    for position in positions
+                ],
+            )
+            self.connection.commit()
+
+    def get_missing_token_ids(self, from_token_id: int, to_token_id: int) -> List[int]:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT token_id FROM positions WHERE token_id >= ? AND token_id < ?",
+                (from_token_id, to_token_id),
+            ).fetchall()
+        known_token_ids = set(row[0] for row in rows)
+        return [
+            token_id
+            for token_id in range(from_token_id, to_token_id)
+            if token_id not in known_token_ids
+        ]
+
+    def get_token_ids(self, token0: str, token1: str, tick_spacing: int) -> List[int]:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT token_id FROM positions "
+                "WHERE token0 = ? AND token1 = ? AND tick_spacing = ? "
+                "ORDER BY token_id",
+                (token0.lower(), token1.lower(), int(tick_spacing)),
+            ).fetchall()
+        return [row[0] for row in rows]
@@ -0,0 +1,84 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Any, Dict, Optional, Tuple
+
+from utils.common import DeFiService
+
+PREFETCH_LOOKAHEAD = 32
+PREFETCH_WORKERS = 8
+
+
+def get_snapshot_schedule(
+    services: List[DeFiService], points: List[int]
+) -> List[List[Tuple[int, List[int], Optional[int]]]]:
+    # replays the iterators of the services over the change points without
+    # moving them: for every point, the services that take a snapshot there
+    # with the change blocks they consume and the block of their last one
+    schedule = [[] for _ in points]
+    for service_index, service in enumerate(services):
+        iterator = service.iterator
+        previous_block_number = service.cached_block_number
+        for index, block_number in enumerate(points):
+            consumed_block_numbers = []
+            while (
+                iterator < len(service.block_numbers)
+                and service.block_numbers[iterator] <= block_number
+            ):
+                consumed_block_numbers.append(service.block_numbers[iterator])
+                iterator += 1
+            if consumed_block_numbers:
+                schedule[index].append(
+                    (service_index, consumed_block_numbers, previous_block_number)
+                )
+                previous_block_number = block_number
+    return schedule
+
+
+class SnapshotPrefetcher:
+    # fetches service snapshots up to lookahead change points ahead in a
+    # worker pool; snapshots are handed out strictly in block order
+    def __init__(
+        self,
+        services: List[DeFiService],
+        points: List[int],
+        lookahead: int = PREFETCH_LOOKAHEAD,
+        max_workers: int = PREFETCH_WORKERS,
+    ):
+        self.services = services
+        self.points = points
+        self.lookahead = lookahead
+        self.schedule = get_snapshot_schedule(services, points)
+        self.futures: Dict[int, List[Tuple[int, List[int], Future]]] = {}
+        self.submitted = 0
+        self.executor = ThreadPoolExecutor(max_workers)
+
+    def submit(self, index: int) -> None:
+        block_number = self.points[index]
+        futures = []
+        for (
+            service_index,
+            consumed_block_numbers,
+            previous_block_number,
+        ) in self.schedule[index]:
+            future = self.executor.submit(
+                self.services[service_index].timed_fetch_snapshot,
+                block_number,
+                consumed_block_numbers,
+                previous_block_number,
+            )
+            futures.append((service_index, consumed_block_numbers, future))
+        self.futures[index] = futures
+
+    def get(self, index: int) -> List[Tuple[DeFiService, List[int], Any]]:
+        while (
+            self.submitted < len(self.points)
+            and self.submitted <= index + self.lookahead
+        ):
+            self.submit(self.submitted)
+            self.submitted += 1
+        return [
+            (self.services[service_index], consumed_block_numbers, future.result())
+            for service_index, consumed_block_numbers, future in self.futures.pop(index)
+        ]
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,140 @@
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+# where the json run report is written, nothing is written when unset
+PROFILE_REPORT = os.getenv("PROFILE_REPORT")
+# directory for cProfile dumps of a batch run, disabled when unset
+PROFILE_CPROFILE_PATH = os.getenv("PROFILE_CPROFILE_PATH")
+
+
+class Profiler:
+    # wall time per stage and counters (rpc requests, payload bytes, cache
+    # hits, ...) attributed to the stage running in the calling thread;
+    # stages nest and their times are summed across threads
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.started = time.time()
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.counters: Dict[str, Dict[str, int]] = {}
+
+    def get_stage(self) -> str:
+        return getattr(self.local, "stage", "other")
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        previous_stage = self.get_stage()
+        self.local.stage = name
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.local.stage = previous_stage
+            with self.lock:
+                stage = self.stages.setdefault(name, {"calls": 0, "seconds": 0.0})
+                stage["calls"] += 1
+                stage["seconds"] += elapsed
+
+    @contextmanager
+    def within(self, name: str) -> Iterator[None]:
+        # attributes the counters of a worker thread to the stage that
+        # handed it the work, without timing it twice
+        previous_stage = self.get_stage()
+        self.local.stage = name
+        try:
+            yield
+        finally:
+            self.local.stage = previous_stage
+
+    def count(self, name: str, value: int = 1, stage: Optional[str] = None) -> None:
+        stage = stage or self.get_stage()
+        with self.lock:
+            counters = self.counters.setdefault(stage, {})
+            counters[name] = counters.get(name, 0) + value
+
+    def reset(self) -> None:
+        with self.lock:
+            self.started = time.time()
+            self.stages = {}
+            self.counters = {}
+
+    def merge(self, report: Dict[str, Any]) -> None:
+        # adds the stages and counters of a report from another process
+        with self.lock:
+            for name, values in report["stages"].items():
+                stage = self.stages.setdefault(name, {"calls": 0, "seconds": 0.0})
+                stage["calls"] += values["calls"]
+                stage["seconds"] += values["seconds"]
+            for name, values in report["counters"].items():
+                counters = self.counters.setdefault(name, {})
+                for counter, value in values.items():
+                    counters[counter] = counters.get(counter, 0) + value
+
+    def get_report(self) -> Dict[str, Any]:
+        with self.lock:
+            stages = {name: dict(stage) for name, stage in self.stages.items()}
+            counters = {name: dict(values) for name, values in self.counters.items()}
+        cache_hit_rates = {}
+        for name, values in counters.items():
+            for cache in ["rpc_cache", "event_cache"]:
+                hits = values.get(cache + ".hits", 0)
+                misses = values.get(cache + ".misses", 0)
+                if hits + misses > 0:
+                    cache_hit_rates.setdefault(name, {})[cache] = hits / (hits + misses)
+        return {
+            "wall_seconds": time.time() - self.started,
+            "stages": stages,
+            "counters": counters,
+            "cache_hit_rates": cache_hit_rates,
+        }
+
+    def write_report(self, file_name: str) -> None:
+        directory = os.path.dirname(file_name)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(file_name, "w") as f:
+            json.dump(self.get_report(), f, indent=2, sort_keys=True)
+
+
+profiler = Profiler()
+
+
+def profile_call(name: str, function: Callable[..., Any], *args, **kwargs) -> Any:
+    # cProfile of the call, dumped to PROFILE_CPROFILE_PATH/name.prof; only
+    # one call can be profiled at a time. From python 3.12 the profiler sees
+    # every thread, before that each thread started during the call gets a
+    # profiler of its own whose stats are added to the dump
+    if PROFILE_CPROFILE_PATH is None:
+        return function(*args, **kwargs)
+    profiles = [cProfile.Profile()]
+    if sys.version_info < (3, 12):
+
+        def start_thread_profile(*_) -> None:
+            profile = cProfile.Profile()
+            profiles.append(profile)
+            profile.enable()
+
+        threading.setprofile(start_thread_profile)
+    profiles[0].enable()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        profiles[0].disable()
+        threading.setprofile(None)
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            try:
+                stats.add(pstats.Stats(profile))
+            except TypeError:
+                # the thread made no calls
+                pass
+        os.makedirs(PROFILE_CPROFILE_PATH, exist_ok=True)
+        stats.dump_stats(os.path.join(PROFILE_CPROFILE_PATH, name + ".prof"))
@@ -0,0 +1,178 @@
+import json
+import mmap
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple, Union
+
+from eth_utils import to_checksum_address
+from utils.columnar import ProofsFile
+
+DISTRIBUTIONS_PATH = "./distributions/lisk"
+HOT_ENTRIES = 65536
+_ROOT_PATTERN = re.compile(r'"root":\s*"(0x[0-9a-fA-F]{64})"')
+_DATA_PATTERN = re.compile(r'"data":\s*\[')
+
+
+class ProofIndex:
+    # address -> row of one vault's proofs file of one epoch; only the
+    # address column is read to build it, entries are decoded on demand
+    def __init__(self, file_name: str):
+        self.proofs = ProofsFile(file_name)
+        self.rows: Dict[bytes, int] = {}
+        for i in range(len(self.proofs)):
+            self.rows[bytes(self.proofs.address_bytes(i))] = i
+
+    def lookup(self, address: str) -> Optional[Dict[str, Any]]:
+        row = self.rows.get(bytes.fromhex(address[2:].lower()))
+        if row is None:
+            return None
+        return self.proofs.entry(row)
+
+    def get_root(self) -> str:
+        return "0x" + self.proofs.root.hex()
+
+
+class JsonProofIndex:
+    # address -> byte range of its entry in a merkle_proofs json file; the
+    # file is scanned once and entries are parsed on demand from the mmap
+    def __init__(self, file_name: str):
+        with open(file_name, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # json.dump escapes non-ascii, so characters and bytes line up
+        text = self.buffer[:].decode("ascii")
+        decoder = json.JSONDecoder()
+        self.root = _ROOT_PATTERN.search(text).group(1)
+        self.rows: Dict[bytes, Tuple[int, int]] = {}
+        index = _DATA_PATTERN.search(text).end()
+        while True:
+            while text[index] in " \r\n\t,":
+                index += 1
+            if text[index] == "]":
+                break
+            entry, end = decoder.raw_decode(text, index)
+            self.rows[bytes.fromhex(entry["address"][2:].lower())] = (index, end)
+            index = end
+
+    def lookup(self, address: str) -> Optional[Dict[str, Any]]:
+        row = self.rows.get(bytes.fromhex(address[2:].lower()))
+        if row is None:
+            return None
+        return json.loads(self.buffer[row[0] : row[1]])
+
+    def get_root(self) -> str:
+        return self.root
+
+
+class ProofLookup:
+    def __init__(
+        self,
+        distributions_path: str = DISTRIBUTIONS_PATH,
+        hot_entries: int = HOT_ENTRIES,
+    ):
+        self.distributions_path = distributions_path
+        self.hot_entries = hot_entries
+        # indices are built outside the lock; requests for an index being
+        # built wait on its future, the others are not held up
+        self.indices: Dict[Tuple[int, str], Future] = {}
+        self.hot: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+
+    def load_index(self, epoch: int, vault: str) -> Union[ProofIndex, JsonProofIndex]:
+        # the columnar file when the epoch has one, the published json
+        # proofs otherwise
+        file_name = os.path.join(
+            self.distributions_path,
+            str(epoch),
+            "merkle_proofs",
+            to_checksum_address(vault),
+        )
+        if os.path.exists(file_name + ".bin"):
+            return ProofIndex(file_name + ".bin")
+        return JsonProofIndex(file_name + ".json")
+
+    def get_index(self, epoch: int, vault: str) -> Union[ProofIndex, JsonProofIndex]:
+        key = (epoch, vault.lower())
+        with self.lock:
+            future = self.indices.get(key)
+            building = future is None
+            if building:
+                future = Future()
+                self.indices[key] = future
+        if building:
+            try:
+                future.set_result(self.load_index(epoch, vault))
+            except Exception as e:
+                # not kept, the epoch may be published later
+                with self.lock:
+                    del self.indices[key]
+                future.set_exception(e)
+        return future.result()
+
+    def lookup(self, epoch: int, vault: str, address: str) -> Optional[Dict[str, Any]]:
+        key = (epoch, vault.lower(), address.lower())
+        with self.lock:
+            if key in self.hot:
+                self.hot.move_to_end(key)
+                return self.hot[key]
+        entry = self.get_index(epoch, vault).lookup(address)
+        if entry is None:
+            return None
+        with self.lock:
+            self.hot[key] = entry
+            if len(self.hot) > self.hot_entries:
+                self.hot.popitem(last=False)
+        return entry
+
+    def root(self, epoch: int, vault: str) -> str:
+        return self.get_index(epoch, vault).get_root()
+
+
+_PATH_PATTERN = re.compile(
+    r"^/proofs/(\d+)/(0x[0-9a-fA-F]{40})(?:/(0x[0-9a-fA-F]{40}))?/?$"
+)
+
+
+def create_server(lookup: ProofLookup, host: str, port: int) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args) -> None:
+            pass
+
+        def respond(self, status: int, data: Any) -> None:
+            body = json.dumps(data).encode()
+            self.send_response(status)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self) -> None:
+            # /proofs/<epoch>/<vault> -> root
+            # /proofs/<epoch>/<vault>/<address> -> proof entry
+            match = _PATH_PATTERN.match(self.path)
+            if not match:
+                return self.respond(404, {"error": "not found"})
+            epoch, vault, address = match.groups()
+            try:
+                if address is None:
+                    return self.respond(200, {"root": lookup.root(int(epoch), vault)})
+                entry = lookup.lookup(int(epoch), vault, address)
+            except FileNotFoundError:
+                return self.respond(404, {"error": "unknown epoch or vault"})
+            if entry is None:
+                return self.respond(404, {"error": "address not found"})
+            return self.respond(200, entry)
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+# run from the repository root: PYTHONPATH=src python -m utils.proof_lookup
+if __name__ == "__main__":
+    host = os.getenv("PROOF_LOOKUP_HOST", "127.0.0.1")
+    port = int(os.getenv("PROOF_LOOKUP_PORT", "8080"))
+    server = create_server(ProofLookup(), host, port)
+    print("Serving proofs on {}:{}...".format(host, port))
+    server.serve_forever()
@@ -0,0 +1,170 @@
+import atexit
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from web3 import Web3
+from web3.types import RPCEndpoint, RPCResponse
+
+from utils.profiling import profiler
+
+RPC_CACHE_PATH = os.getenv("RPC_CACHE_PATH", "./cache/rpc.sqlite")
+RPC_CACHE_MAX_ENTRIES = int(os.getenv("RPC_CACHE_MAX_ENTRIES", "1000000"))
+
+# position of the block identifier in the params of each cacheable method
+CACHED_METHODS = {
+    "eth_call": 1,
+    "eth_getStorageAt": 2,
+}
+
+
+def get_request_key(method: str, params: Any) -> Optional[bytes]:
+    if method not in CACHED_METHODS:
+        return None
+    index = CACHED_METHODS[method]
+    if len(params) <= index:
+        return None
+    block_identifier = params[index]
+    if isinstance(block_identifier, str):
+        if not block_identifier.startswith("0x"):
+            # latest, pending, safe, ...
+            return None
+        block_identifier = int(block_identifier, 16)
+    elif not isinstance(block_identifier, int):
+        return None
+    params = list(params)
+    params[index] = block_identifier
+    return hashlib.sha256(
+        json.dumps([method, params], sort_keys=True).encode()
+    ).digest()
+
+
+class RpcCache:
+    def __init__(
+        self, path: str = RPC_CACHE_PATH, max_entries: int = RPC_CACHE_MAX_ENTRIES
+    ):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_entries = max_entries
+        # access times of hits, written with the next put or on exit
+        self.accessed: Dict[bytes, int] = {}
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key BLOB PRIMARY KEY, "
+            "result TEXT NOT NULL, "
+            "accessed INTEGER NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)"
+        )
+        self.connection.commit()
+        self.size, self.clock = self.connection.execute(
+            "SELECT COUNT(*), COALESCE(MAX(accessed), 0) FROM entries"
+        ).fetchone()
+
+    def get(self, key: bytes) -> Optional[Any]:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT result FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                profiler.count("rpc_cache.misses")
+                return None
+            profiler.count("rpc_cache.hits")
+            self.clock += 1
+            self.accessed[key] = self.clock
+        return json.loads(row[0])
+
+    def put(self, key: bytes, result: Any) -> None:
+        with self.lock:
+            self.write_accessed()
+            self.clock += 1
+            inserted = self.connection.execute(
+                "INSERT OR IGNORE INTO entries (key, result, accessed) VALUES (?, ?, ?)",
+                (key, json.dumps(result), self.clock),
+            ).rowcount
+            self.size += inserted
+            if self.size > self.max_entries:
+                self.evict()
+            self.connection.commit()
+
+    def flush(self) -> None:
+        with self.lock:
+            self.write_accessed()
+            self.connection.commit()
+
+    def write_accessed(self) -> None:
+        if not self.accessed:
+            return
+        self.connection.executemany(
+            "UPDATE entries SET accessed = ? WHERE key = ?",
+            [(clock, key) for key, clock in self.accessed.items()],
+        )
+        self.accessed = {}
+
+    def evict(self) -> None:
+        # drop the least recently used tenth to amortize the deletes
+        count = self.size - self.max_entries + self.max_entries // 10
+        self.connection.execute(
+            "DELETE FROM entries WHERE key IN "
+            "(SELECT key FROM entries ORDER BY accessed LIMIT ?)",
+            (count,),
+        )
+        self.size = self.connection.execute("SELECT COUNT(*) FROM entries").fetchone()[
+            0
+        ]
+
+
+_rpc_cache: Optional[RpcCache] = None
+_rpc_cache_lock = threading.Lock()
+
+
+def get_rpc_cache() -> RpcCache:
+    global _rpc_cache
+    with _rpc_cache_lock:
+        if _rpc_cache is None:
+            _rpc_cache = RpcCache()
+            atexit.register(_rpc_cache.flush)
+    return _rpc_cache
+
+
+def get_cached_results(
+    rpc_requests: List[Tuple[str, Any]],
+) -> Tuple[List[Optional[bytes]], List[Optional[Any]], List[int]]:
+    # cache keys and cached results of the requests, with the indices of
+    # the ones that still have to be sent; uncacheable requests have no key
+    keys = [get_request_key(method, params) for method, params in rpc_requests]
+    if any(key is not None for key in keys):
+        cache = get_rpc_cache()
+        results = [cache.get(key) if key is not None else None for key in keys]
+    else:
+        results = [None] * len(keys)
+    missing = [index for index, result in enumerate(results) if result is None]
+    return keys, results, missing
+
+
+def put_response(key: Optional[bytes], response: RPCResponse) -> None:
+    if key is not None and "result" in response and "error" not in response:
+        get_rpc_cache().put(key, response["result"])
+
+
+def rpc_cache_middleware(
+    make_request: Callable[[RPCEndpoint, Any], RPCResponse], w3: Web3
+) -> Callable[[RPCEndpoint, Any], RPCResponse]:
+    def middleware(method: RPCEndpoint, params: Any) -> RPCResponse:
+        keys, results, missing = get_cached_results([(method, params)])
+        if not missing:
+            return {"jsonrpc": "2.0", "id": 0, "result": results[0]}
+        response = make_request(method, params)
+        put_response(keys[0], response)
+        return response
+
+    return middleware
@@ -0,0 +1,81 @@
+import os
+import random
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Callable
+
+# off: no checks, sampled: a random share of the checks, full: every check
+VERIFICATION_POLICY = os.getenv("VERIFICATION_POLICY", "full")
+VERIFICATION_SAMPLE_RATE = float(os.getenv("VERIFICATION_SAMPLE_RATE", "0.1"))
+VERIFICATION_WORKERS = 4
+POLICIES = ["off", "sampled", "full"]
+
+
+class Verifier:
+    # runs consistency checks in a worker pool, off the accumulation path,
+    # and collects every discrepancy instead of stopping at the first one
+    def __init__(
+        self,
+        policy: str = VERIFICATION_POLICY,
+        sample_rate: float = VERIFICATION_SAMPLE_RATE,
+        max_workers: int = VERIFICATION_WORKERS,
+        seed: int = 0,
+    ):
+        if policy not in POLICIES:
+            raise Exception("Verifier: unknown policy {}".format(policy))
+        self.policy = policy
+        self.sample_rate = sample_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.discrepancies: List[str] = []
+        self.futures: List[Future] = []
+        self.checks = 0
+        self.executor = ThreadPoolExecutor(max_workers)
+
+    def should_check(self) -> bool:
+        if self.policy == "off":
+            return False
+        if self.policy == "sampled":
+            return self.random.random() < self.sample_rate
+        return True
+
+    def submit(self, name: str, check: Callable[[], List[str]]) -> None:
+        # check returns the discrepancies it found
+        if not self.should_check():
+            return
+        self.checks += 1
+        self.futures.append(self.executor.submit(self.run, name, check))
+
+    def run(self, name: str, check: Callable[[], List[str]]) -> None:
+        try:
+            messages = check()
+        except Exception as e:
+            messages = ["check failed: {}".format(e)]
+        with self.lock:
+            for message in messages:
+                self.discrepancies.append("{}: {}".format(name, message))
+
+    def wait(self) -> List[str]:
+        for future in self.futures:
+            future.result()
+        self.futures = []
+        with self.lock:
+            return list(self.discrepancies)
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def finish(self) -> None:
+        discrepancies = self.wait()
+        self.close()
+        print(
+            "Verification ({}): {} checks, {} discrepancies".format(
+                self.policy, self.checks, len(discrepancies)
+            )
+        )
+        if discrepancies:
+            raise Exception(
+                "Verifier: {} discrepancies\n{}".format(
+                    len(discrepancies), "\n".join(discrepancies)
+                )
+            )